@@ -0,0 +1,154 @@
+import json
+import os
+
+import numpy as np
+
+from recognition.vectors import normalize
+
+INDEX_ARRAYS = ('centroids', 'codebooks', 'codes', 'ids', 'offsets', 'vectors')
+
+
+def squared_distances(vectors, points):
+    """Squared L2 distances between every row of ``vectors`` and every row of ``points``."""
+    return (
+        (vectors ** 2).sum(axis=1)[:, np.newaxis]
+        - 2 * vectors.dot(points.T)
+        + (points ** 2).sum(axis=1)[np.newaxis, :]
+    )
+
+
+def kmeans(vectors, clusters_count, iterations=20, seed=0):
+    """Plain Lloyd's k-means, returns a ``(clusters_count, dimension)`` float32 matrix."""
+    random = np.random.RandomState(seed)
+    clusters_count = min(clusters_count, len(vectors))
+    centroids = vectors[random.choice(len(vectors), clusters_count, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = squared_distances(vectors, centroids).argmin(axis=1)
+        for cluster in range(clusters_count):
+            members = vectors[assignments == cluster]
+            if len(members):
+                centroids[cluster] = members.mean(axis=0)
+            else:
+                # Re-seed empty clusters instead of letting them die
+                centroids[cluster] = vectors[random.randint(len(vectors))]
+    return centroids.astype(np.float32)
+
+
+class IVFPQIndex:
+    """Inverted lists over coarse centroids with product-quantized residuals.
+
+    Vectors are L2-normalized, so the squared distance ``d`` between a query
+    and a vector maps to cosine similarity as ``1 - d / 2``. Codes are stored
+    grouped by inverted list (``offsets`` delimits every list), which keeps a
+    probed list contiguous when the index is memory-mapped.
+
+    ``nlist`` and ``subquantizers`` trade index size and build time for recall.
+    At search time ``nprobe`` (lists visited per query) trades latency for
+    recall, and ``refine_factor`` re-scores the best ``k * refine_factor``
+    candidates exactly against float16 copies of the vectors.
+    """
+
+    def __init__(self, centroids, codebooks, codes, ids, offsets, vectors,
+                 nprobe=8, refine_factor=4, built_at=None):
+        self.centroids = centroids
+        self.codebooks = codebooks
+        self.codes = codes
+        self.ids = ids
+        self.offsets = offsets
+        self.vectors = vectors
+        self.nprobe = nprobe
+        self.refine_factor = refine_factor
+        self.built_at = built_at
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def subquantizers(self):
+        return self.codebooks.shape[0]
+
+    @classmethod
+    def train(cls, ids, vectors, nlist, subquantizers, iterations=20, built_at=None):
+        vectors = normalize(vectors)
+        dimension = vectors.shape[1]
+        if dimension % subquantizers:
+            raise ValueError(f'Dimension {dimension} is not divisible by {subquantizers} subquantizers')
+        subdimension = dimension // subquantizers
+
+        centroids = kmeans(vectors, nlist, iterations)
+        assignments = squared_distances(vectors, centroids).argmin(axis=1)
+        residuals = vectors - centroids[assignments]
+
+        codebooks = []
+        codes = np.empty((len(vectors), subquantizers), dtype=np.uint8)
+        for subquantizer in range(subquantizers):
+            subvectors = residuals[:, subquantizer * subdimension:(subquantizer + 1) * subdimension]
+            codebook = kmeans(subvectors, 256, iterations, seed=subquantizer)
+            codes[:, subquantizer] = squared_distances(subvectors, codebook).argmin(axis=1)
+            if len(codebook) < 256:
+                codebook = np.vstack([codebook, np.zeros((256 - len(codebook), subdimension), np.float32)])
+            codebooks.append(codebook)
+
+        order = np.argsort(assignments, kind='mergesort')
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assignments, minlength=len(centroids)))
+        return cls(
+            centroids=centroids,
+            codebooks=np.stack(codebooks),
+            codes=np.ascontiguousarray(codes[order]),
+            ids=np.asarray(ids, dtype=np.int64)[order],
+            offsets=offsets,
+            vectors=vectors[order].astype(np.float16),
+            built_at=built_at,
+        )
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name in INDEX_ARRAYS:
+            np.save(os.path.join(path, f'{name}.npy'), getattr(self, name))
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'built_at': self.built_at}, f)
+
+    @classmethod
+    def load(cls, path, nprobe=8, refine_factor=4):
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in INDEX_ARRAYS}
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        return cls(nprobe=nprobe, refine_factor=refine_factor, built_at=meta['built_at'], **arrays)
+
+    def search(self, vector, k=1, nprobe=None, refine_factor=None):
+        """Return up to ``k`` ``(painting_id, cosine_similarity)`` pairs, best first."""
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        refine_factor = self.refine_factor if refine_factor is None else refine_factor
+        query = normalize(vector)
+        subdimension = self.codebooks.shape[2]
+        subquantizer_range = np.arange(self.subquantizers)
+
+        coarse_distances = squared_distances(query[np.newaxis], self.centroids)[0]
+        probed_lists = np.argpartition(coarse_distances, nprobe - 1)[:nprobe]
+
+        candidate_rows = []
+        candidate_distances = []
+        for inverted_list in probed_lists:
+            start, end = self.offsets[inverted_list], self.offsets[inverted_list + 1]
+            if start == end:
+                continue
+            residual = (query - self.centroids[inverted_list]).reshape(self.subquantizers, 1, subdimension)
+            distance_table = ((self.codebooks - residual) ** 2).sum(axis=2)
+            codes = self.codes[start:end]
+            candidate_distances.append(distance_table[subquantizer_range, codes].sum(axis=1))
+            candidate_rows.append(np.arange(start, end))
+        if not candidate_rows:
+            return []
+
+        distances = np.concatenate(candidate_distances)
+        rows = np.concatenate(candidate_rows)
+        if refine_factor:
+            shortlist_size = min(k * refine_factor, len(rows))
+            # Sorted rows turn the float16 lookups into forward reads of the mapped file
+            rows = np.sort(rows[np.argpartition(distances, shortlist_size - 1)[:shortlist_size]])
+            distances = ((self.vectors[rows].astype(np.float32) - query) ** 2).sum(axis=1)
+        k = min(k, len(rows))
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top])]
+        return [(int(self.ids[rows[i]]), float(1 - distances[i] / 2)) for i in top]
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class RecognitionConfig(AppConfig):
     name = 'recognition'
+
+    def ready(self):
+        from recognition import signals  # noqa: F401
@@ -0,0 +1,101 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger('tretyakov.recognition')
+
+STOP = object()
+
+
+class BatchDispatcher:
+    """Groups concurrent calls into batches handled by a single worker thread.
+
+    ``run_batch`` receives a list of submitted items and must return a list of
+    results in the same order. A batch is dispatched as soon as it holds
+    ``max_batch_size`` items or ``max_wait`` seconds passed since its first item.
+    """
+
+    def __init__(self, run_batch, max_batch_size, max_wait):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batches_count = 0
+        self.items_count = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, item):
+        """Queue ``item`` and block until its result is ready."""
+        future = Future()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, args=(self._queue,),
+                                                name='recognition-batcher', daemon=True)
+                self._thread.start()
+            self._queue.put((item, future))
+        return future.result()
+
+    def close(self):
+        """Stop the worker thread once it handled the items already queued."""
+        with self._lock:
+            thread = self._thread
+            if thread is None:
+                return
+            self._queue.put(STOP)
+            # A submit after close starts a new worker on a new queue
+            self._queue = queue.Queue()
+            self._thread = None
+        thread.join()
+
+    def status(self):
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait': self.max_wait,
+            'batches_count': self.batches_count,
+            'items_count': self.items_count,
+        }
+
+    def _collect_batch(self, items_queue):
+        """Return the next batch and whether the worker must stop after it."""
+        entry = items_queue.get()
+        if entry is STOP:
+            return [], True
+        batch = [entry]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                entry = items_queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if entry is STOP:
+                return batch, True
+            batch.append(entry)
+        return batch, False
+
+    def _work(self, items_queue):
+        while True:
+            batch, stop = self._collect_batch(items_queue)
+            if batch:
+                self._run(batch)
+            if stop:
+                return
+
+    def _run(self, batch):
+        items = [item for item, _ in batch]
+        try:
+            results = self.run_batch(items)
+        except Exception as e:
+            logger.exception('Batch of %s item(s) failed', len(items))
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self.batches_count += 1
+        self.items_count += len(items)
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import suppress
+
+from django.conf import settings
+
+from recognition.generations import get_generation, move_generation
+
+logger = logging.getLogger('tretyakov.recognition')
+
+GENERATION_KEY = 'recognition-cache-generation'
+
+
+class RecognitionCache:
+    """Bounded LRU cache of recognition results with an optional file-backed tier.
+
+    Keys are expected to be derived from the uploaded bytes and the model
+    version, values must be JSON serializable. Entries evicted from memory
+    stay in ``directory`` (when given) and are promoted back on a hit.
+
+    ``invalidate`` moves to a new generation kept in the Django cache, seen by
+    every process sharing that cache. Entries live under their generation, so
+    a process drops its memory tier and the files of older generations once,
+    when it sees a new one.
+    """
+
+    def __init__(self, max_entries, directory=None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.hits = 0
+        self.file_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._generation = None
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key):
+        generation = self._sync_generation()
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+        value = self._read_file(generation, key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.file_hits += 1
+        self.hits += 1
+        self._remember(key, value)
+        return value
+
+    def set(self, key, value):
+        generation = self._sync_generation()
+        self._remember(key, value)
+        self._write_file(generation, key, value)
+
+    def invalidate(self):
+        move_generation(GENERATION_KEY)
+
+    def status(self):
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'file_hits': self.file_hits,
+            'misses': self.misses,
+        }
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _sync_generation(self):
+        generation = get_generation(GENERATION_KEY)
+        if generation == self._generation:
+            return generation
+        with self._lock:
+            if generation == self._generation:
+                return generation
+            self._entries.clear()
+            self._generation = generation
+        if self.directory:
+            self._remove_files_before(generation)
+        return generation
+
+    def _remove_files_before(self, generation):
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not os.path.isdir(path):
+                # Entries stored before generations were kept in the directory itself
+                with suppress(FileNotFoundError):
+                    os.remove(path)
+            elif float(name) < float(generation):
+                # Newer generations are kept, the Django cache may not be shared by every process
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _get_path(self, generation, key):
+        file_name = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.directory, generation, f'{file_name}.json')
+
+    def _read_file(self, generation, key):
+        if not self.directory:
+            return None
+        try:
+            with open(self._get_path(generation, key)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logger.warning('Broken recognition cache entry %s', key)
+            return None
+
+    def _write_file(self, generation, key, value):
+        if not self.directory:
+            return
+        path = self._get_path(generation, key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first so readers never see a partial entry
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(value, f)
+            os.replace(temp_path, path)
+        except FileNotFoundError:
+            # Another process moved to a newer generation and removed this one
+            logger.debug('Recognition cache generation %s is gone', generation)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_recognition_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = RecognitionCache(
+                    max_entries=settings.RECOGNITION_CACHE_MAX_ENTRIES,
+                    directory=settings.RECOGNITION_CACHE_DIR,
+                )
+    return _cache
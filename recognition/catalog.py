@@ -0,0 +1,38 @@
+import hashlib
+
+from django.db.models import Count, Max
+from django.views.decorators.http import condition
+
+from recognition.models import Author, Painting
+
+
+def get_catalog_version(request=None):
+    """Return the version of the catalog from two aggregate queries.
+
+    The version changes whenever a painting or an author is added, edited or
+    removed. Passing ``request`` memoizes the version for the request.
+    """
+    version = getattr(request, '_catalog_version', None)
+    if version is not None:
+        return version
+
+    paintings = Painting.objects.aggregate(count=Count('id'), max_id=Max('id'), modified=Max('modified'))
+    authors = Author.objects.aggregate(count=Count('id'), max_id=Max('id'), modified=Max('modified'))
+    version = '.'.join(str(value) for value in (
+        paintings['count'], paintings['max_id'], paintings['modified'] and paintings['modified'].timestamp(),
+        authors['count'], authors['max_id'], authors['modified'] and authors['modified'].timestamp(),
+    ))
+    if request is not None:
+        request._catalog_version = version
+    return version
+
+
+def get_catalog_etag(request, *args, **kwargs):
+    version = get_catalog_version(request)
+    # Page, fields and renderer are all picked from the URL and the Accept header
+    key = f'{version}|{request.get_host()}|{request.get_full_path()}|{request.META.get("HTTP_ACCEPT", "")}'
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+# No Last-Modified: the latest modification time stays the same when a row is deleted
+catalog_condition = condition(etag_func=get_catalog_etag)
@@ -0,0 +1,107 @@
+import io
+import json
+import logging
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image
+
+from recognition.models import Painting
+
+logger = logging.getLogger('tretyakov.recognition')
+
+FORMAT_EXTENSIONS = {'jpeg': 'jpg', 'webp': 'webp'}
+
+
+def get_derivative_name(width, image_format):
+    return f'derivatives/{width}.{FORMAT_EXTENSIONS[image_format]}'
+
+
+def render_derivatives(image_data, widths, formats, quality):
+    """Yield ``(width, format, bytes)`` of ``image_data`` scaled down to every width.
+
+    Widths not smaller than the original are skipped, images are never upscaled.
+    """
+    image = Image.open(io.BytesIO(image_data))
+    original_width, original_height = image.size
+    widths = sorted((width for width in widths if width < original_width), reverse=True)
+    if not widths:
+        return
+    # Let the JPEG decoder scale down by a power of two for the largest width
+    image.draft('RGB', (widths[0], widths[0] * original_height // original_width))
+    image = image.convert('RGB')
+    for width in widths:
+        # Every width is resized from the previous one, which is cheaper than from the original
+        height = max(1, round(original_height * width / original_width))
+        image = image.resize((width, height), Image.LANCZOS)
+        for image_format in formats:
+            buffer = io.BytesIO()
+            image.save(buffer, format=image_format.upper(), quality=quality)
+            yield width, image_format, buffer.getvalue()
+
+
+def store_derivatives(storage, image_data):
+    """Store scaled down copies of ``image_data``, returns their names as ``{format: {width: name}}``."""
+    derivatives = {}
+    rendered = render_derivatives(
+        image_data,
+        widths=settings.PAINTING_DERIVATIVE_WIDTHS,
+        formats=settings.PAINTING_DERIVATIVE_FORMATS,
+        quality=settings.PAINTING_DERIVATIVE_QUALITY,
+    )
+    for width, image_format, content in rendered:
+        # The image storage names files by content, the name only gives the directory and extension
+        name = storage.save(get_derivative_name(width, image_format), ContentFile(content))
+        derivatives.setdefault(image_format, {})[str(width)] = name
+    return derivatives
+
+
+def get_derivative_names(derivatives):
+    """Return the set of file names in stored ``derivatives`` JSON."""
+    if not derivatives:
+        return set()
+    return {name for names in json.loads(derivatives).values() for name in names.values()}
+
+
+def delete_derivatives(storage, names, painting_id):
+    """Delete derivative files no painting but ``painting_id`` refers to.
+
+    Content-hashed names are shared by paintings with the same image.
+    """
+    for name in names:
+        if not Painting.objects.exclude(id=painting_id).filter(derivatives__contains=name).exists():
+            storage.delete(name)
+
+
+def generate_derivatives(painting, image_data=None):
+    """Store scaled down copies of the painting image and save their names on the painting.
+
+    Files of the previous derivatives that are not reused are deleted.
+    """
+    if image_data is None:
+        # FieldFile.open() returns None before Django 2.0, read through the storage instead
+        with painting.image.storage.open(painting.image.name, 'rb') as f:
+            image_data = f.read()
+    old_names = get_derivative_names(painting.derivatives)
+    derivatives = store_derivatives(painting.image.storage, image_data)
+    painting.derivatives = json.dumps(derivatives, sort_keys=True)
+    painting.save(update_fields=('derivatives', 'modified'))
+    delete_derivatives(painting.image.storage, old_names - get_derivative_names(painting.derivatives), painting.id)
+    logger.debug('Generated %s derivative(s) of painting %s', sum(map(len, derivatives.values())), painting.id)
+    return derivatives
+
+
+def get_srcset(derivatives, storage, request=None):
+    """Map every format of stored ``derivatives`` JSON to a ``srcset`` attribute value."""
+    if not derivatives:
+        return {}
+    srcset = {}
+    for image_format, names in json.loads(derivatives).items():
+        candidates = []
+        for width, name in sorted(names.items(), key=lambda item: int(item[0])):
+            url = storage.url(name)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            candidates.append(f'{url} {width}w')
+        srcset[image_format] = ', '.join(candidates)
+    return srcset
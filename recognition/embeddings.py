@@ -0,0 +1,157 @@
+import os
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+from recognition.ann import IVFPQIndex
+from recognition.models import Painting
+from recognition.vectors import bytes_to_vector, normalize
+
+CLASSIFIER_MODE = 'classifier'
+EMBEDDING_MODE = 'embedding'
+
+
+class EmbeddingIndex:
+    """Painting embeddings kept as one contiguous, L2-normalized float32 matrix.
+
+    Adding a painting appends a row (the storage grows by doubling), so a
+    query is a single matrix-vector product followed by a partial sort.
+    """
+
+    def __init__(self, dimension, capacity=1024):
+        self.dimension = dimension
+        self.size = 0
+        self._matrix = np.empty((capacity, dimension), dtype=np.float32)
+        self._ids = np.empty(capacity, dtype=np.int64)
+        self._rows = {}
+        self._lock = threading.Lock()
+
+    @property
+    def matrix(self):
+        return self._matrix[:self.size]
+
+    @property
+    def ids(self):
+        return self._ids[:self.size]
+
+    def __len__(self):
+        return self.size
+
+    def add(self, painting_id, vector):
+        vector = normalize(vector)
+        with self._lock:
+            row = self._rows.get(painting_id)
+            if row is None:
+                if self.size == len(self._ids):
+                    self._grow()
+                row = self.size
+                self._ids[row] = painting_id
+                self._rows[painting_id] = row
+                self.size += 1
+            self._matrix[row] = vector
+
+    def remove(self, painting_id):
+        with self._lock:
+            row = self._rows.pop(painting_id, None)
+            if row is None:
+                return
+            last_row = self.size - 1
+            if row != last_row:
+                self._matrix[row] = self._matrix[last_row]
+                self._ids[row] = self._ids[last_row]
+                self._rows[int(self._ids[row])] = row
+            self.size = last_row
+
+    def search(self, vector, k=1):
+        """Return up to ``k`` ``(painting_id, cosine_similarity)`` pairs, best first."""
+        size = self.size
+        matrix, ids = self._matrix[:size], self._ids[:size]
+        if not size:
+            return []
+        k = min(k, size)
+        scores = matrix.dot(normalize(vector))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[row]), float(scores[row])) for row in top]
+
+    def _grow(self):
+        capacity = len(self._ids) * 2
+        matrix = np.empty((capacity, self.dimension), dtype=np.float32)
+        matrix[:self.size] = self._matrix[:self.size]
+        ids = np.empty(capacity, dtype=np.int64)
+        ids[:self.size] = self._ids[:self.size]
+        self._matrix, self._ids = matrix, ids
+
+
+class CatalogEmbeddingIndex(EmbeddingIndex):
+    """An EmbeddingIndex that picks up newly embedded paintings from the database.
+
+    With an ``ann_index`` the bulk of the catalog is searched approximately and
+    only paintings embedded after the ANN index was built are kept exactly.
+    """
+
+    def __init__(self, dimension, refresh_interval, ann_index=None):
+        super().__init__(dimension)
+        self.refresh_interval = refresh_interval
+        self.refreshed_at = 0
+        self.embedded_since = None
+        self.ann_index = ann_index
+        self.removed_ids = set()
+        if ann_index is not None:
+            self.embedded_since = parse_datetime(ann_index.built_at)
+
+    def refresh(self):
+        queryset = Painting.objects.exclude(embedding=None).order_by('embedded_at')
+        if self.embedded_since is not None:
+            queryset = queryset.filter(embedded_at__gte=self.embedded_since)
+        for painting_id, embedding, embedded_at in queryset.values_list('id', 'embedding', 'embedded_at').iterator():
+            self.add(painting_id, bytes_to_vector(embedding))
+            self.embedded_since = embedded_at
+        self.refreshed_at = time.monotonic()
+
+    def remove(self, painting_id):
+        super().remove(painting_id)
+        if self.ann_index is not None:
+            self.removed_ids.add(painting_id)
+
+    def search(self, vector, k=1):
+        if time.monotonic() - self.refreshed_at > self.refresh_interval:
+            self.refresh()
+        matches = super().search(vector, k)
+        if self.ann_index is None:
+            return matches
+
+        # Every painting held exactly was re-embedded after the ANN build, its ANN entry is stale
+        stale_count = self.size + len(self.removed_ids)
+        for painting_id, score in self.ann_index.search(vector, k + stale_count):
+            if painting_id not in self._rows and painting_id not in self.removed_ids:
+                matches.append((painting_id, score))
+        matches.sort(key=lambda match: match[1], reverse=True)
+        return matches[:k]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_embedding_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                ann_index = None
+                if os.path.exists(settings.RECOGNITION_ANN_INDEX_PATH):
+                    ann_index = IVFPQIndex.load(
+                        settings.RECOGNITION_ANN_INDEX_PATH,
+                        nprobe=settings.RECOGNITION_ANN_NPROBE,
+                        refine_factor=settings.RECOGNITION_ANN_REFINE_FACTOR,
+                    )
+                _index = CatalogEmbeddingIndex(
+                    dimension=settings.RECOGNITION_EMBEDDING_DIMENSION,
+                    refresh_interval=settings.RECOGNITION_EMBEDDING_REFRESH_INTERVAL,
+                    ann_index=ann_index,
+                )
+    return _index
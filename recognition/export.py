@@ -0,0 +1,49 @@
+import zlib
+
+from rest_framework.compat import SHORT_SEPARATORS
+from rest_framework.renderers import JSONRenderer
+
+from recognition.models import Painting
+from recognition.serializers import PaintingRowsSerializer
+
+EXPORT_CHUNK_SIZE = 500
+
+
+def iter_painting_lines(fields=None, expand=(), request=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield the catalog as NDJSON, one encoded chunk of ``chunk_size`` paintings at a time.
+
+    Rows are read in id keyset chunks and serialized per chunk, so memory does
+    not grow with the catalog. ``iterator()`` would not do: SQLite has no
+    chunked reads in Django and fetches every row at once.
+    """
+    rows_serializer = PaintingRowsSerializer(fields, expand, request)
+    encoder = get_encoder()
+    queryset = rows_serializer.setup_queryset(Painting.objects.order_by('id'))
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id)[:chunk_size])
+        if chunk:
+            yield encode_lines(encoder, rows_serializer.serialize(chunk))
+        if len(chunk) < chunk_size:
+            return
+        last_id = chunk[-1]['id']
+
+
+def get_encoder():
+    """The encoder JSONRenderer would use, built once per export instead of once per line."""
+    renderer = JSONRenderer()
+    return renderer.encoder_class(ensure_ascii=renderer.ensure_ascii, allow_nan=not renderer.strict,
+                                  separators=SHORT_SEPARATORS)
+
+
+def encode_lines(encoder, payloads):
+    return ''.join(f'{encoder.encode(payload)}\n' for payload in payloads).encode('utf-8')
+
+
+def gzip_stream(chunks, compresslevel=6):
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
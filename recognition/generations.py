@@ -0,0 +1,22 @@
+import time
+
+from django.core.cache import cache
+
+
+def get_generation(key):
+    """Return the current generation stored under ``key`` in the Django cache, creating one if needed."""
+    generation = cache.get(key)
+    if generation is None:
+        # Never fall back to a fixed value: entries of an evicted generation must stay unreachable
+        cache.add(key, new_generation(), None)
+        generation = cache.get(key)
+    return generation
+
+
+def move_generation(key):
+    """Make every entry of the current generation unreachable."""
+    cache.set(key, new_generation(), None)
+
+
+def new_generation():
+    return f'{time.time():.6f}'
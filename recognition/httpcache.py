@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+import tempfile
+
+
+class HTTPCache:
+    """Responses of the crawled site on disk with their validators.
+
+    Every URL has a ``<sha1>.json`` file with the ETag, Last-Modified and
+    charset of its response and, unless only validators are kept (images live
+    in the media storage already), a ``<sha1>.body`` file with the body.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.not_modified_count = 0
+        self.modified_count = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, url):
+        try:
+            with open(self._get_path(url, 'json')) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def get_body(self, url):
+        try:
+            with open(self._get_path(url, 'body'), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, url, headers, charset=None, body=None):
+        entry = {
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'content_length': headers.get('Content-Length'),
+            'charset': charset,
+        }
+        if body is not None:
+            self._write(self._get_path(url, 'body'), body)
+        self._write(self._get_path(url, 'json'), json.dumps(entry).encode())
+
+    def get_conditional_headers(self, url):
+        """``If-None-Match`` and ``If-Modified-Since`` headers for the cached response of ``url``."""
+        entry = self.get(url)
+        headers = {}
+        if entry is not None:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def _get_path(self, url, ext):
+        file_name = hashlib.sha1(url.encode()).hexdigest()
+        return os.path.join(self.directory, f'{file_name}.{ext}')
+
+    def _write(self, path, content):
+        # Write to a temporary file first so an interrupted crawl never leaves a partial entry
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.replace(temp_path, path)
+
+
+async def fetch_page(session, http_cache, url):
+    """Return the text of ``url`` and whether it changed since it was cached.
+
+    A cached page is revalidated with a conditional request, so an unchanged
+    one costs a 304 without a body.
+    """
+    cached_body = http_cache.get_body(url)
+    headers = http_cache.get_conditional_headers(url) if cached_body is not None else {}
+    async with session.get(url, headers=headers) as resp:
+        if resp.status == 304 and cached_body is not None:
+            http_cache.not_modified_count += 1
+            charset = http_cache.get(url)['charset']
+            return cached_body.decode(charset or 'utf-8'), False
+        resp.raise_for_status()
+        text = await resp.text()
+        http_cache.modified_count += 1
+        http_cache.set(url, resp.headers, resp.charset, text.encode(resp.charset or 'utf-8'))
+    return text, True
+
+
+async def is_image_unchanged(session, http_cache, url):
+    """Check with a HEAD request whether the image at ``url`` is the one downloaded last time."""
+    entry = http_cache.get(url)
+    if entry is None:
+        return False
+    async with session.head(url, headers=http_cache.get_conditional_headers(url)) as resp:
+        if resp.status == 304:
+            unchanged = True
+        elif resp.status != 200:
+            unchanged = False
+        elif entry['etag'] or resp.headers.get('ETag'):
+            unchanged = entry['etag'] == resp.headers.get('ETag')
+        else:
+            # Without ETags fall back to the size and modification date
+            unchanged = (entry['last_modified'] is not None
+                         and entry['last_modified'] == resp.headers.get('Last-Modified')
+                         and entry['content_length'] == resp.headers.get('Content-Length'))
+    if unchanged:
+        http_cache.not_modified_count += 1
+    return unchanged
+
+
+async def fetch_image(session, http_cache, url):
+    async with session.get(url) as resp:
+        resp.raise_for_status()
+        binary_image = await resp.read()
+        http_cache.modified_count += 1
+        # Only validators, the image itself is kept by the media storage
+        http_cache.set(url, resp.headers)
+    return binary_image
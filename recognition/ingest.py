@@ -0,0 +1,116 @@
+import json
+import logging
+
+from django.core.files.base import ContentFile
+from django.db.transaction import atomic
+
+from recognition.cache import get_recognition_cache
+from recognition.derivatives import delete_derivatives, get_derivative_names, store_derivatives
+from recognition.lookup import label_lookup_registry
+from recognition.models import Author, Painting
+from recognition.payloads import painting_payload_cache
+from recognition.search import index_paintings
+
+logger = logging.getLogger('tretyakov.parser')
+
+
+def store_image_files(metainfo, binary_image):
+    """Save a crawled image and its derivatives, returns ``(image name, derivatives JSON)``.
+
+    Only touches the media storage, so it can run in parallel with other images.
+    """
+    field = Painting._meta.get_field('image')
+    name = field.generate_filename(None, metainfo['filename'])
+    image_name = field.storage.save(name, ContentFile(binary_image), max_length=field.max_length)
+    derivatives = store_derivatives(field.storage, binary_image)
+    return image_name, json.dumps(derivatives, sort_keys=True)
+
+
+def delete_image_files(files):
+    """Delete an image and its derivatives, ``(image name, derivatives JSON)``, no saved painting refers to."""
+    storage = Painting._meta.get_field('image').storage
+    image_name, derivatives = files
+    # Content-hashed files may be shared with other paintings
+    if image_name and not Painting.objects.filter(image=image_name).exists():
+        storage.delete(image_name)
+    delete_derivatives(storage, get_derivative_names(derivatives), painting_id=None)
+
+
+class PaintingBatchWriter:
+    """Saves crawled paintings a batch at a time: one transaction and one bulk_create per batch.
+
+    Authors are resolved through an in-memory cache of the whole author table,
+    image files must already be stored with ``store_image_files``.
+    """
+
+    def __init__(self):
+        self._author_ids = None
+
+    def get_author_id(self, author):
+        if self._author_ids is None:
+            self._author_ids = {
+                (last_name, first_name, middle_name): author_id
+                for author_id, last_name, first_name, middle_name
+                in Author.objects.values_list('id', 'last_name', 'first_name', 'middle_name')
+            }
+        key = (author['last_name'], author['first_name'], author['middle_name'])
+        author_id = self._author_ids.get(key)
+        if author_id is None:
+            author_id = self._author_ids[key] = Author.objects.create(**author).id
+        return author_id
+
+    def write(self, items):
+        """Create or update paintings of ``(metainfo, files)`` pairs in one transaction.
+
+        ``files`` come from ``store_image_files``, they are None for a painting
+        whose image did not change. Files of a batch that rolls back are deleted,
+        and so are the replaced files of updated paintings once it commits.
+        Caches and the search index are left to ``notify_saved``.
+        """
+        site_urls = [metainfo['site_url'] for metainfo, _ in items]
+        try:
+            with atomic():
+                replaced_files = self._write(items, site_urls)
+        except Exception:
+            # Authors created in the rolled back transaction are gone
+            self._author_ids = None
+            for _, files in items:
+                if files is not None:
+                    delete_image_files(files)
+            raise
+        for files in replaced_files:
+            delete_image_files(files)
+        logger.info('Saved %s painting(s)', len(items))
+
+    def notify_saved(self, items):
+        """Do what post_save receivers would for paintings saved by ``write``, bulk_create sends no signals."""
+        site_urls = [metainfo['site_url'] for metainfo, _ in items]
+        get_recognition_cache().invalidate()
+        label_lookup_registry.mark_stale()
+        painting_payload_cache.invalidate()
+        index_paintings(Painting.objects.filter(site_url__in=site_urls).select_related('author').defer('embedding'))
+
+    def _write(self, items, site_urls):
+        """Save the batch, returns the files that updated paintings no longer use."""
+        existing = {painting.site_url: painting
+                    for painting in Painting.objects.filter(site_url__in=site_urls).defer('embedding')}
+        created = []
+        replaced_files = []
+        for metainfo, files in items:
+            painting = existing.get(metainfo['site_url'])
+            if painting is None:
+                painting = existing[metainfo['site_url']] = Painting(site_url=metainfo['site_url'])
+                created.append(painting)
+            painting.author_id = self.get_author_id(metainfo['author'])
+            painting.title = metainfo['title']
+            painting.years = metainfo['years']
+            painting.description = metainfo['description']
+            if files is not None:
+                if painting.pk is not None:
+                    replaced_files.append((painting.image.name, painting.derivatives))
+                painting.image, painting.derivatives = files
+            if painting.pk is not None:
+                # Only --refresh re-crawls known paintings, updates are rare
+                painting.save()
+        Painting.objects.bulk_create(created)
+        return replaced_files
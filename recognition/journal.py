@@ -0,0 +1,79 @@
+import json
+import sqlite3
+import time
+
+LIST_STAGE = 'list'
+DETAIL_STAGE = 'detail'
+IMAGE_STAGE = 'image'
+
+DONE = 'done'
+FAILED = 'failed'
+
+
+class CrawlJournal:
+    """Stage, status and content hash of every URL of a crawl, in an SQLite file.
+
+    Results of done URLs (links of a list page, metainfo of a detail page) are
+    kept, so a resumed crawl continues without fetching them again. Every
+    record is committed at once: a killed crawl loses at most the URLs in flight.
+    """
+
+    def __init__(self, file_name):
+        self.connection = sqlite3.connect(file_name)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS entry ('
+            'url TEXT NOT NULL, stage TEXT NOT NULL, status TEXT NOT NULL, content_hash TEXT, '
+            'data TEXT, updated_at REAL NOT NULL, PRIMARY KEY (url, stage))'
+        )
+        self.connection.execute('CREATE TABLE IF NOT EXISTS crawl (finished INTEGER NOT NULL)')
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def is_interrupted(self):
+        """Whether a crawl recorded here has not finished."""
+        row = self.connection.execute('SELECT finished FROM crawl').fetchone()
+        return row is not None and not row[0]
+
+    def start(self, resume=False):
+        """Start a crawl, keeping the entries only when ``resume`` continues an interrupted one.
+
+        Resuming a finished crawl would serve every page from the journal and
+        never see what changed on the site, so it starts over instead.
+        """
+        resume = resume and self.is_interrupted()
+        with self.connection:
+            if not resume:
+                self.connection.execute('DELETE FROM entry')
+            self.connection.execute('DELETE FROM crawl')
+            self.connection.execute('INSERT INTO crawl (finished) VALUES (0)')
+
+    def finish(self):
+        with self.connection:
+            self.connection.execute('UPDATE crawl SET finished = 1')
+
+    def get_done(self, url, stage):
+        """Return ``(data, content_hash)`` when ``url`` is done at ``stage``, ``None`` otherwise."""
+        row = self.connection.execute(
+            'SELECT data, content_hash FROM entry WHERE url = ? AND stage = ? AND status = ?',
+            (url, stage, DONE),
+        ).fetchone()
+        if row is None:
+            return None
+        data, content_hash = row
+        return json.loads(data) if data is not None else None, content_hash
+
+    def record(self, url, stage, status, content_hash=None, data=None):
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO entry (url, stage, status, content_hash, data, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (url, stage, status, content_hash, None if data is None else json.dumps(data, ensure_ascii=False),
+                 time.time()),
+            )
+
+    def count(self, status):
+        return self.connection.execute('SELECT COUNT(*) FROM entry WHERE status = ?', (status,)).fetchone()[0]
@@ -0,0 +1,200 @@
+import itertools
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from recognition.catalog import get_catalog_version
+from recognition.embeddings import EMBEDDING_MODE
+from recognition.models import Painting
+from recognition.serializers import PaintingSerializer
+
+logger = logging.getLogger('tretyakov.recognition')
+
+LOOKUP_EXPAND = ('author',)
+
+
+def absolutize_payload(payload, request):
+    """Turn image paths of a payload rendered without a request into absolute URLs."""
+
+    def build_absolute_uri(url):
+        return request.build_absolute_uri(url) if url else url
+
+    def absolutize_painting(painting):
+        painting = dict(painting)
+        if 'image' in painting:
+            painting['image'] = build_absolute_uri(painting['image'])
+        if 'srcset' in painting:
+            painting['srcset'] = {
+                image_format: ', '.join(
+                    f'{build_absolute_uri(url)} {width}'
+                    for url, width in (candidate.rsplit(' ', 1) for candidate in srcset.split(', '))
+                )
+                for image_format, srcset in painting['srcset'].items()
+            }
+        return painting
+
+    payload = absolutize_painting(payload)
+    author = payload.get('author')
+    if isinstance(author, dict) and 'paintings' in author:
+        payload['author'] = dict(author, paintings=[absolutize_painting(painting) for painting in author['paintings']])
+    return payload
+
+
+class LabelLookup:
+    """Model labels mapped to painting ids and their pre-rendered payloads.
+
+    Payloads are rendered without a request, so image URLs are relative
+    and must go through ``absolutize_payload`` before being returned. They
+    expand the author but not the author's paintings, which would make the
+    lookup grow with the square of every author's painting count.
+    """
+
+    def __init__(self, model_version, catalog_version, painting_ids, payloads):
+        self.model_version = model_version
+        self.catalog_version = catalog_version
+        self.painting_ids = painting_ids
+        self.payloads = payloads
+
+    @classmethod
+    def build(cls, recognizer, catalog_version):
+        if recognizer.mode == EMBEDDING_MODE:
+            ids = Painting.objects.exclude(embedding=None).values_list('id', flat=True)
+            painting_ids = {str(painting_id): painting_id for painting_id in ids}
+        else:
+            recognizer.load()
+            # Labels are the names of the folders prepared by the prepare_data command
+            painting_ids = {label: int(label) for label in recognizer.labels if label.isdigit()}
+
+        paintings = PaintingSerializer.setup_eager_loading(Painting.objects.filter(id__in=painting_ids.values()),
+                                                           expand=LOOKUP_EXPAND)
+        context = {'expand': LOOKUP_EXPAND}
+        payloads = {str(painting.id): PaintingSerializer(painting, context=context).data for painting in paintings}
+        painting_ids = {label: painting_id for label, painting_id in painting_ids.items()
+                        if str(painting_id) in payloads}
+        return cls(recognizer.model_version, catalog_version, painting_ids, payloads)
+
+    @classmethod
+    def load(cls, file_name):
+        with open(file_name) as f:
+            return cls(**json.load(f))
+
+    def save(self, file_name):
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(file_name), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({
+                'model_version': self.model_version,
+                'catalog_version': self.catalog_version,
+                'painting_ids': self.painting_ids,
+                'payloads': self.payloads,
+            }, f, ensure_ascii=False)
+        os.replace(temp_path, file_name)
+
+    def get_painting_id(self, label):
+        return self.painting_ids.get(str(label))
+
+    def get_payload(self, label):
+        painting_id = self.get_painting_id(label)
+        if painting_id is None:
+            return None
+        return self.payloads[str(painting_id)]
+
+
+class LabelLookupRegistry:
+    """Keeps the lookup of the current model in sync with the catalog.
+
+    Catalog changes made in this process mark the lookup stale through
+    signals at once; changes made elsewhere, edits included, are noticed by
+    comparing the catalog version at most every ``check_interval`` seconds.
+
+    Only the first lookup of a model is built on the request path. Later
+    rebuilds run in a background thread while the previous lookup keeps
+    serving; its payloads must not be trusted while ``stale`` is set.
+    """
+
+    def __init__(self, file_name, check_interval):
+        self.file_name = file_name
+        self.check_interval = check_interval
+        self.lookup = None
+        self.checked_at = 0
+        self.changes_count = 0
+        self.built_changes_count = 0
+        self._changes = itertools.count(1)
+        self._refresh_thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def stale(self):
+        return self.changes_count != self.built_changes_count
+
+    def mark_stale(self):
+        self.changes_count = next(self._changes)
+
+    def get(self, recognizer):
+        lookup = self.lookup
+        if lookup is None or lookup.model_version != recognizer.model_version:
+            # Nothing to serve meanwhile
+            with self._lock:
+                self._refresh(recognizer)
+                return self.lookup
+        if self.stale or time.monotonic() - self.checked_at >= self.check_interval:
+            self._start_refresh(recognizer)
+        return lookup
+
+    def _start_refresh(self, recognizer):
+        with self._lock:
+            if self._refresh_thread is not None:
+                return
+            self._refresh_thread = threading.Thread(
+                target=self._refresh_in_background, args=(recognizer,), name='label-lookup-refresh', daemon=True,
+            )
+            self._refresh_thread.start()
+
+    def _refresh_in_background(self, recognizer):
+        try:
+            with self._lock:
+                self._refresh(recognizer)
+        except Exception:
+            logger.exception('Label lookup refresh failed')
+        finally:
+            self._refresh_thread = None
+            connection.close()
+
+    def _refresh(self, recognizer):
+        # Changes signalled in this process force a rebuild without comparing versions
+        changes_count = self.changes_count
+        force = self.stale
+        catalog_version = get_catalog_version()
+        self.checked_at = time.monotonic()
+        lookup = self.lookup
+        if (not force
+                and lookup is not None
+                and lookup.model_version == recognizer.model_version
+                and lookup.catalog_version == catalog_version):
+            return
+
+        if not force and os.path.exists(self.file_name):
+            lookup = LabelLookup.load(self.file_name)
+            if (lookup.model_version == recognizer.model_version
+                    and lookup.catalog_version == catalog_version):
+                self.lookup = lookup
+                return
+
+        started = time.monotonic()
+        self.lookup = LabelLookup.build(recognizer, catalog_version)
+        self.lookup.save(self.file_name)
+        # Changes made while building are picked up by the next refresh
+        self.built_changes_count = changes_count
+        logger.info('Label lookup of %s painting(s) built in %.3fs',
+                    len(self.lookup.payloads), time.monotonic() - started)
+
+
+label_lookup_registry = LabelLookupRegistry(
+    file_name=settings.RECOGNITION_LOOKUP_FILE,
+    check_interval=settings.RECOGNITION_LOOKUP_CHECK_INTERVAL,
+)
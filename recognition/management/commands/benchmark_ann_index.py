@@ -0,0 +1,57 @@
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from recognition.ann import IVFPQIndex
+from recognition.embeddings import EmbeddingIndex
+from recognition.management.commands.build_ann_index import load_catalog_embeddings
+
+
+class Command(BaseCommand):
+    help = 'Compare recall@k and latency of the ANN index against exact search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=settings.RECOGNITION_ANN_INDEX_PATH)
+        parser.add_argument('-k', type=int, default=10)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--noise', type=float, default=0.05,
+                            help='Gaussian noise added to catalog vectors to make queries')
+        parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+        parser.add_argument('--refine-factor', type=int, nargs='+', default=[0, 4])
+
+    def handle(self, *args, **options):
+        ids, vectors = load_catalog_embeddings()
+        if not len(ids):
+            raise CommandError('No painting embeddings, run index_paintings first')
+        k = options['k']
+
+        exact_index = EmbeddingIndex(vectors.shape[1], capacity=len(ids))
+        for painting_id, vector in zip(ids, vectors):
+            exact_index.add(int(painting_id), vector)
+        ann_index = IVFPQIndex.load(options['path'])
+
+        random = np.random.RandomState(0)
+        sample = random.choice(len(vectors), min(options['queries'], len(vectors)), replace=False)
+        queries = vectors[sample] + random.normal(scale=options['noise'], size=vectors[sample].shape)
+
+        started = time.perf_counter()
+        expected = [{painting_id for painting_id, _ in exact_index.search(query, k)} for query in queries]
+        exact_latency = (time.perf_counter() - started) / len(queries)
+        self.stdout.write(f'{len(ids)} painting(s), {len(queries)} queries, k={k}')
+        self.stdout.write(f'exact                        recall@{k}=1.000  {exact_latency * 1000:8.3f} ms/query')
+
+        for nprobe in options['nprobe']:
+            for refine_factor in options['refine_factor']:
+                found = 0
+                started = time.perf_counter()
+                for query, expected_ids in zip(queries, expected):
+                    matches = ann_index.search(query, k, nprobe=nprobe, refine_factor=refine_factor)
+                    found += len(expected_ids.intersection(painting_id for painting_id, _ in matches))
+                latency = (time.perf_counter() - started) / len(queries)
+                recall = found / sum(len(expected_ids) for expected_ids in expected)
+                self.stdout.write(
+                    f'ivfpq nprobe={nprobe:<4} refine={refine_factor:<3} '
+                    f'recall@{k}={recall:.3f}  {latency * 1000:8.3f} ms/query'
+                )
@@ -0,0 +1,57 @@
+import time
+from base64 import b64encode
+from urllib.parse import urlencode
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.test import APIRequestFactory
+
+from recognition.models import Painting
+from recognition.views import PaintingViewSet
+
+
+def encode_cursor(position):
+    # Same format as CursorPagination.encode_cursor for a forward cursor without offset
+    return b64encode(urlencode({'p': position}).encode('ascii')).decode('ascii')
+
+
+class Command(BaseCommand):
+    help = 'Compare page-number and cursor pagination latency of the painting list on deep pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, nargs='+', default=[1, 10, 100, 1000])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        page_size = PageNumberPagination.page_size
+        paintings_count = Painting.objects.count()
+        if not paintings_count:
+            raise CommandError('No paintings to paginate')
+
+        view = PaintingViewSet.as_view({'get': 'list'})
+        factory = APIRequestFactory()
+        self.stdout.write(f'{paintings_count} painting(s), {page_size} per page')
+        for page in options['pages']:
+            offset = (page - 1) * page_size
+            if offset >= paintings_count:
+                break
+            # The cursor of a page points after the last painting of the previous one
+            previous_id = (Painting.objects.order_by('id').values_list('id', flat=True)[offset - 1]
+                           if offset else 0)
+            page_number_time = self.measure(view, factory, {'page': page}, options['repeat'])
+            cursor_time = self.measure(view, factory, {'cursor': encode_cursor(previous_id)}, options['repeat'])
+            self.stdout.write(
+                f'page {page:>6}: page number {page_number_time * 1000:8.2f} ms, '
+                f'cursor {cursor_time * 1000:8.2f} ms'
+            )
+
+    def measure(self, view, factory, params, repeat):
+        best = None
+        for _ in range(repeat):
+            request = factory.get('/recognition/painting/', params)
+            started = time.perf_counter()
+            response = view(request)
+            response.render()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best
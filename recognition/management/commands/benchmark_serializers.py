@@ -0,0 +1,78 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from recognition.models import Author, Painting
+from recognition.serializers import FULL_EXPAND, PaintingRowsSerializer, PaintingSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compare PaintingSerializer with the values() fast path on generated paintings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--paintings', type=int, default=10000)
+        parser.add_argument('--authors', type=int, default=500)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        request = APIRequestFactory().get('/recognition/painting/')
+        # The generated catalog never outlives the benchmark
+        with transaction.atomic():
+            ids = self.create_catalog(options['paintings'], options['authors'])
+            queryset = Painting.objects.filter(id__in=ids).order_by('id')
+            self.stdout.write(f'{len(ids)} painting(s) by {options["authors"]} author(s)')
+            for expand in ((), ('author',), FULL_EXPAND):
+                serializer_time, content = self.measure(
+                    lambda: self.render_with_serializer(queryset, expand, request), options['repeat'])
+                rows_time, rows_content = self.measure(
+                    lambda: self.render_rows(queryset, expand, request), options['repeat'])
+                self.stdout.write(
+                    f'expand={",".join(expand) or "-":<24} serializer {serializer_time * 1000:9.2f} ms, '
+                    f'fast path {rows_time * 1000:9.2f} ms, '
+                    f'identical: {content == rows_content}'
+                )
+            transaction.set_rollback(True)
+
+    def create_catalog(self, paintings_count, authors_count):
+        authors = Author.objects.bulk_create(
+            Author(first_name=f'First {i}', middle_name=f'Middle {i}', last_name=f'Benchmark {i}')
+            for i in range(authors_count)
+        )
+        if not authors[0].id:
+            # Backends without RETURNING do not set ids on bulk created objects
+            authors = list(Author.objects.filter(last_name__startswith='Benchmark ').order_by('-id')[:authors_count])
+        first_id = (Painting.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+        Painting.objects.bulk_create(
+            Painting(
+                id=painting_id,
+                author=authors[painting_id % len(authors)],
+                title=f'Benchmark painting {painting_id}',
+                image=f'paintings/benchmark-{painting_id}.jpg',
+                site_url=f'https://example.com/benchmark/{painting_id}',
+                years='1880',
+                description='Холст, масло',
+            )
+            for painting_id in range(first_id, first_id + paintings_count)
+        )
+        return list(range(first_id, first_id + paintings_count))
+
+    def render_with_serializer(self, queryset, expand, request):
+        paintings = PaintingSerializer.setup_eager_loading(queryset, expand=expand)
+        context = {'request': request, 'fields': None, 'expand': expand}
+        return JSONRenderer().render(PaintingSerializer(paintings, many=True, context=context).data)
+
+    def render_rows(self, queryset, expand, request):
+        rows_serializer = PaintingRowsSerializer(expand=expand, request=request)
+        return JSONRenderer().render(rows_serializer.serialize(rows_serializer.setup_queryset(queryset)))
+
+    def measure(self, render, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            content = render()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, content
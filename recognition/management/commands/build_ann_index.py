@@ -0,0 +1,52 @@
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from recognition.ann import IVFPQIndex
+from recognition.models import Painting
+from recognition.vectors import bytes_to_vector
+
+
+def load_catalog_embeddings():
+    rows = Painting.objects.exclude(embedding=None).order_by('id').values_list('id', 'embedding')
+    ids = []
+    vectors = []
+    for painting_id, embedding in rows.iterator():
+        ids.append(painting_id)
+        vectors.append(bytes_to_vector(embedding))
+    if not ids:
+        return np.empty(0, np.int64), np.empty((0, settings.RECOGNITION_EMBEDDING_DIMENSION), np.float32)
+    return np.asarray(ids, dtype=np.int64), np.vstack(vectors)
+
+
+class Command(BaseCommand):
+    help = 'Build the approximate nearest-neighbour index over painting embeddings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=settings.RECOGNITION_ANN_INDEX_PATH)
+        parser.add_argument('--nlist', type=int, help='Inverted lists count, sqrt(paintings) by default')
+        parser.add_argument('--subquantizers', type=int, default=91,
+                            help='Must divide the embedding dimension')
+        parser.add_argument('--iterations', type=int, default=20)
+
+    def handle(self, *args, **options):
+        built_at = timezone.now()
+        ids, vectors = load_catalog_embeddings()
+        if not len(ids):
+            raise CommandError('No painting embeddings, run index_paintings first')
+
+        nlist = options['nlist'] or max(1, int(np.sqrt(len(ids))))
+        index = IVFPQIndex.train(
+            ids,
+            vectors,
+            nlist=nlist,
+            subquantizers=options['subquantizers'],
+            iterations=options['iterations'],
+            built_at=built_at.isoformat(),
+        )
+        index.save(options['path'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully build index of {len(ids)} painting(s) in {nlist} list(s) at {options["path"]}'
+        ))
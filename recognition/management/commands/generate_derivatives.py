@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from recognition.derivatives import generate_derivatives
+from recognition.models import Painting
+
+
+class Command(BaseCommand):
+    help = 'Generate scaled down JPEG and WebP copies of painting images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Regenerate paintings that already have derivatives')
+
+    def handle(self, *args, **options):
+        queryset = Painting.objects.order_by('id').select_related('author').defer('embedding')
+        if not options['all']:
+            queryset = queryset.filter(derivatives='')
+
+        count = 0
+        for painting in queryset.iterator():
+            generate_derivatives(painting)
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully generate derivatives of {count} painting(s)'))
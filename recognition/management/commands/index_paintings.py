@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recognition.models import Painting
+from recognition.recognizer import Recognizer
+from recognition.vectors import vector_to_bytes
+
+
+class Command(BaseCommand):
+    help = 'Store bottleneck embeddings of painting images for the embedding recognition mode'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Re-embed paintings that already have an embedding')
+
+    def handle(self, *args, **options):
+        recognizer = Recognizer.from_settings()
+        queryset = Painting.objects.order_by('id').only('id', 'image')
+        if not options['all']:
+            queryset = queryset.filter(embedding=None)
+
+        count = 0
+        for painting in queryset.iterator():
+            with open(painting.image.path, 'rb') as f:
+                embedding = recognizer.embed_image(f.read())
+            Painting.objects.filter(id=painting.id).update(
+                embedding=vector_to_bytes(embedding),
+                embedded_at=timezone.now(),
+            )
+            count += 1
+        recognizer.close()
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully index {count} painting(s)'))
@@ -0,0 +1,29 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand
+from django.db.transaction import atomic
+
+from recognition.models import Exhibition
+
+DEFAULT_PROGRAM_FILE = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, 'data', 'program.json')
+
+
+class Command(BaseCommand):
+    help = 'Replace the exhibitions program with the one from a JSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', nargs='?', default=DEFAULT_PROGRAM_FILE)
+
+    def handle(self, *args, **options):
+        with open(options['file'], encoding='utf-8') as f:
+            program = json.load(f)
+
+        with atomic():
+            Exhibition.objects.all().delete()
+            Exhibition.objects.bulk_create(
+                Exhibition(position=position, **exhibition)
+                for position, exhibition in enumerate(program)
+            )
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully load {len(program)} exhibition(s)'))
@@ -1,19 +1,21 @@
 import asyncio
 import copy
+import hashlib
 import logging
 import os
+import time
 from concurrent.futures import ThreadPoolExecutor
-from itertools import chain
 
 import aiohttp
 import re
 from bs4 import BeautifulSoup
 from django.conf import settings
-from django.core.files.base import ContentFile
-from django.core.management.base import BaseCommand
-from django.db.transaction import atomic
+from django.core.management.base import BaseCommand, CommandError
 
-from recognition.models import Author, Painting
+from recognition.httpcache import HTTPCache, fetch_image, fetch_page, is_image_unchanged
+from recognition.ingest import PaintingBatchWriter, store_image_files
+from recognition.journal import DETAIL_STAGE, DONE, FAILED, IMAGE_STAGE, LIST_STAGE, CrawlJournal
+from recognition.models import Painting
 
 BASE_URL = 'https://www.tretyakovgallery.ru'
 
@@ -22,8 +24,27 @@ PAINTINGS_DIR = os.path.join(settings.STATIC_ROOT, 'paintings')
 
 logger = logging.getLogger('tretyakov.parser')
 
+# Every request goes to the same host: keep a bounded pool of warm connections
+CONNECTIONS_PER_HOST = 20
+KEEPALIVE_TIMEOUT = 60
+DNS_CACHE_TTL = 10 * 60
+
+# Pipeline stages: workers per stage and capacity of the queue feeding it
+LIST_PAGE_WORKERS = 10
+DETAIL_PAGE_WORKERS = 20
+IMAGE_WORKERS = 20
+QUEUE_SIZE = 100
+# Stored images wait for the DB writer, which takes them a batch at a time
+IMAGE_QUEUE_SIZE = 100
+SAVE_BATCH_SIZE = 100
+# Threads writing image files and rendering derivatives
+FILE_WORKERS = 4
+
+STOP = object()
+
 # To don't lock sqlite 1 worker used
 thread_pool_executor = ThreadPoolExecutor(max_workers=1)
+files_executor = ThreadPoolExecutor(max_workers=FILE_WORKERS)
 
 
 alias_re = re.compile(r'\(.*\)$')
@@ -33,23 +54,50 @@ def get_absolute_url(relative_url):
     return f'{BASE_URL}{relative_url}'
 
 
-async def parse_paintings_list(page, semaphore):
-    async with semaphore:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(PAINTING_LIST_URL_TEMPLATE.format(page=page)) as resp:
-                text = await resp.text()
+class CountingTCPConnector(aiohttp.TCPConnector):
+    """TCPConnector counting requests and the connections (TLS handshakes) opened for them."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.requests_count = 0
+        self.connections_count = 0
+
+    async def connect(self, req):
+        self.requests_count += 1
+        return await super().connect(req)
+
+    async def _create_connection(self, req):
+        self.connections_count += 1
+        return await super()._create_connection(req)
+
+
+def create_session(keepalive=True):
+    if keepalive:
+        connector = CountingTCPConnector(
+            limit_per_host=CONNECTIONS_PER_HOST,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=DNS_CACHE_TTL,
+        )
+    else:
+        # A connection per request, as every request used to open its own session
+        connector = CountingTCPConnector(limit_per_host=CONNECTIONS_PER_HOST, force_close=True, use_dns_cache=False)
+    return aiohttp.ClientSession(connector=connector)
+
+
+def get_content_hash(content):
+    return hashlib.sha1(content).hexdigest()
+
+
+def parse_paintings_list(text):
     soup = BeautifulSoup(text, 'html.parser')
     paintings = (soup
                  .find('div', {'class': 'collections__list'})
                  .find_all('a', {'class': 'collections-item'}))
-    logger.debug('Images list item links from page %s finished', page)
     return [get_absolute_url(painting['href']) for painting in paintings]
 
 
-async def get_pages_count():
-    async with aiohttp.ClientSession() as session:
-        async with session.get(PAINTING_LIST_URL_TEMPLATE.format(page=1)) as resp:
-            text = await resp.text()
+async def get_pages_count(session, http_cache):
+    text, _ = await fetch_page(session, http_cache, PAINTING_LIST_URL_TEMPLATE.format(page=1))
     soup = BeautifulSoup(text, 'html.parser')
     last_pagination_item = (soup
                             .find('ul', attrs={'class': 'collections-nav__list pagination'})
@@ -58,12 +106,7 @@ async def get_pages_count():
     return int(last_pagination_item.span.string)
 
 
-async def get_painting_metainfo(url, semaphore):
-    async with aiohttp.ClientSession() as session:
-        async with semaphore:
-            logger.info('Getting metainfo from %s', url)
-            async with session.get(url) as resp:
-                text = await resp.text()
+def parse_painting_metainfo(url, text):
     soup = BeautifulSoup(text, 'html.parser')
     title_with_year = soup.find('div', {'class': 'exhibit-info__title'}).string
     image_tag = soup.find('div', {'class': 'exhibit-slide'}).find('img')
@@ -114,100 +157,210 @@ async def get_painting_metainfo(url, semaphore):
     }
 
 
-@atomic
-def save_painting(metainfo, binary_image):
-    author, _ = Author.objects.get_or_create(**metainfo['author'])
-    site_url = metainfo['site_url']
-    old_painting = Painting.objects.filter(site_url=site_url).first()
-    if old_painting:
-        logger.debug('Skip painting saving %s', site_url)
-        return
-
-    painting = Painting(
-        author=author,
-        site_url=metainfo['site_url'],
-        title=metainfo['title'],
-        years=metainfo['years'],
-        description=metainfo['description'],
-    )
-    painting.image.save(metainfo['filename'], ContentFile(binary_image))
-
-
-async def fetch_image(metainfo, semaphore):
-    image_url = metainfo['image_url']
-    async with aiohttp.ClientSession() as session:
-        async with semaphore:
-            async with session.get(image_url) as resp:
-                binary_image = await resp.read()
-    await asyncio.get_event_loop().run_in_executor(
-        thread_pool_executor,
-        save_painting,
-        metainfo,
-        binary_image
-    )
-    logger.info('Save %s', metainfo['title'])
-
-
-def normalize_metainfo_list(raw_metainfo_list):
-    metainfo_list = []
-    for item_raw_metainfo in raw_metainfo_list:
-        item_metainfo = copy.copy(item_raw_metainfo)
-        image_url = item_raw_metainfo['image_url']
-        _, ext = os.path.splitext(image_url)
-        filename = f'{item_raw_metainfo["title"]}{ext}'
-        item_metainfo['filename'] = filename
-        metainfo_list.append(item_metainfo)
+def normalize_metainfo(raw_metainfo):
+    metainfo = copy.copy(raw_metainfo)
+    _, ext = os.path.splitext(raw_metainfo['image_url'])
+    metainfo['filename'] = f'{raw_metainfo["title"]}{ext}'
+    return metainfo
+
+
+async def run_stage(name, handle, in_queue, out_queue, workers_count):
+    """Run ``workers_count`` workers passing every result of ``handle`` to ``out_queue``.
+
+    ``handle`` takes an item and returns an iterable of results. The stage ends
+    when STOP comes out of ``in_queue``, then STOP is passed on to the next one.
+    """
+
+    async def work():
+        while True:
+            item = await in_queue.get()
+            if item is STOP:
+                # Let the other workers of the stage see it too
+                await in_queue.put(STOP)
+                return
+            try:
+                results = await handle(item)
+            except Exception:
+                logger.exception('Stage %s failed on %s', name, item)
+                continue
+            if out_queue is not None:
+                for result in results:
+                    await out_queue.put(result)
+
+    await asyncio.gather(*(work() for _ in range(workers_count)))
+    logger.info('Stage %s finished', name)
+    if out_queue is not None:
+        await out_queue.put(STOP)
+
+
+async def run_journaled(journal, url, stage, produce):
+    """Return the journaled result of ``url`` at ``stage``, or ``produce`` and journal it.
+
+    ``produce`` is a coroutine function returning ``(result, content_hash)``.
+    """
+    done = journal.get_done(url, stage)
+    if done is not None:
+        return done[0]
+    try:
+        result, content_hash = await produce()
+    except Exception:
+        journal.record(url, stage, FAILED)
+        raise
+    journal.record(url, stage, DONE, content_hash, result)
+    return result
+
+
+async def write_paintings(queue, journal):
+    """Save paintings coming from ``queue`` in batches of SAVE_BATCH_SIZE, the last batch at STOP."""
+    loop = asyncio.get_event_loop()
+    writer = PaintingBatchWriter()
+    batch = []
+    while True:
+        item = await queue.get()
+        if item is not STOP:
+            batch.append(item)
+        if batch and (item is STOP or len(batch) == SAVE_BATCH_SIZE):
+            items = [(metainfo, files) for metainfo, files, _ in batch]
+            try:
+                # One writer, sqlite takes one at a time
+                await loop.run_in_executor(thread_pool_executor, writer.write, items)
+            except Exception:
+                logger.exception('Saving %s painting(s) failed', len(batch))
+                for metainfo, _, _ in batch:
+                    journal.record(metainfo['image_url'], IMAGE_STAGE, FAILED)
+            else:
+                # The batch is committed whatever happens next
+                for metainfo, _, content_hash in batch:
+                    journal.record(metainfo['image_url'], IMAGE_STAGE, DONE, content_hash)
+                try:
+                    await loop.run_in_executor(thread_pool_executor, writer.notify_saved, items)
+                except Exception:
+                    logger.exception('Updating caches and the search index for %s saved painting(s) failed, '
+                                     'run rebuild_search_index', len(batch))
+            batch = []
+        if item is STOP:
+            logger.info('Stage save finished')
+            return
+
+
+async def run_parser(session, journal, http_cache, pages_count=None, refresh=False):
+    """Crawl as overlapping stages: list pages, detail pages, images, DB writes.
+
+    Bounded queues between the stages keep memory flat, a stage that gets ahead
+    waits for the next one instead of piling up work. Pages and images done
+    according to ``journal`` are not fetched again.
+
+    Paintings already in the catalog are skipped unless ``refresh`` is set; then
+    their detail pages and images are revalidated and only paintings with a
+    changed page or image are saved again, the image downloaded only if it
+    changed.
+    """
+    max_pages_count = await get_pages_count(session, http_cache)
+    pages_count = min(pages_count, max_pages_count) if pages_count else max_pages_count
+    loop = asyncio.get_event_loop()
+    os.makedirs(PAINTINGS_DIR, exist_ok=True)
+    catalog_site_urls = set(Painting.objects.values_list('site_url', flat=True))
+    # Site URLs already queued during this crawl, or skipped
+    seen_site_urls = set() if refresh else set(catalog_site_urls)
 
-    return metainfo_list
+    async def parse_list_page(page):
+        url = PAINTING_LIST_URL_TEMPLATE.format(page=page)
 
+        async def produce():
+            text, _ = await fetch_page(session, http_cache, url)
+            logger.debug('Images list item links from page %s finished', page)
+            return parse_paintings_list(text), get_content_hash(text.encode())
 
-async def run_parser(pages_count=None):
-    max_pages_count = await get_pages_count()
-    pages_count = min(pages_count, max_pages_count) if pages_count else max_pages_count
+        site_urls = [url for url in await run_journaled(journal, url, LIST_STAGE, produce)
+                     if url not in seen_site_urls]
+        seen_site_urls.update(site_urls)
+        return site_urls
 
-    logger.info('Parse list items links')
-    links_semaphore = asyncio.Semaphore(50)
-    tasks = []
+    async def parse_detail_page(url):
+        async def produce():
+            logger.info('Getting metainfo from %s', url)
+            text, modified = await fetch_page(session, http_cache, url)
+            metainfo = parse_painting_metainfo(url, text)
+            if metainfo is None:
+                return None, get_content_hash(text.encode())
+            metainfo = normalize_metainfo(metainfo)
+            # An unchanged page of a known painting still goes on, its image may have changed
+            metainfo['page_modified'] = modified or url not in catalog_site_urls
+            return metainfo, get_content_hash(text.encode())
+
+        metainfo = await run_journaled(journal, url, DETAIL_STAGE, produce)
+        return [metainfo] if metainfo else []
+
+    async def store_image(metainfo):
+        image_url = metainfo['image_url']
+        if journal.get_done(image_url, IMAGE_STAGE) is not None:
+            return []
+        if metainfo['site_url'] in catalog_site_urls and await is_image_unchanged(session, http_cache, image_url):
+            # Nothing to save when neither the page nor the image changed
+            return [(metainfo, None, None)] if metainfo.get('page_modified', True) else []
+        binary_image = await fetch_image(session, http_cache, image_url)
+        # Files go to the storage before the batch reaches the DB writer
+        files = await loop.run_in_executor(files_executor, store_image_files, metainfo, binary_image)
+        return [(metainfo, files, get_content_hash(binary_image))]
+
+    pages_queue = asyncio.Queue()
     for page in range(1, pages_count + 1):
-        tasks.append(parse_paintings_list(page, links_semaphore))
-    site_urls = list(chain.from_iterable(await asyncio.gather(*tasks)))
-
-    site_urls = set(site_urls)
-    site_urls = site_urls.difference(Painting.objects.values_list('site_url', flat=True))
-    if not site_urls:
-        return pages_count
-
-    logger.info('Fetch meta info')
-    meta_semaphore = asyncio.Semaphore(20)
-    tasks = []
-    for url in site_urls:
-        tasks.append(get_painting_metainfo(url, meta_semaphore))
-    raw_metainfo_list = [item_metainfo
-                         for item_metainfo in await asyncio.gather(*tasks)
-                         if item_metainfo]
-    if not raw_metainfo_list:
-        return pages_count
-
-    metainfo_list = normalize_metainfo_list(raw_metainfo_list)
-
-    logger.info('Fetch images')
-    os.makedirs(PAINTINGS_DIR, exist_ok=True)
-    tasks = []
-    images_semaphore = asyncio.Semaphore(20)
-    for item_metainfo in metainfo_list:
-        tasks.append(fetch_image(item_metainfo, images_semaphore))
-    await asyncio.wait(tasks)
+        pages_queue.put_nowait(page)
+    pages_queue.put_nowait(STOP)
+    site_urls_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    metainfo_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    images_queue = asyncio.Queue(maxsize=IMAGE_QUEUE_SIZE)
+
+    await asyncio.gather(
+        run_stage('list pages', parse_list_page, pages_queue, site_urls_queue, LIST_PAGE_WORKERS),
+        run_stage('detail pages', parse_detail_page, site_urls_queue, metainfo_queue, DETAIL_PAGE_WORKERS),
+        run_stage('images', store_image, metainfo_queue, images_queue, IMAGE_WORKERS),
+        write_paintings(images_queue, journal),
+    )
     return pages_count
 
 
+async def crawl(journal, http_cache, pages_count=None, keepalive=True, refresh=False):
+    async with create_session(keepalive) as session:
+        pages_count = await run_parser(session, journal, http_cache, pages_count, refresh)
+        return pages_count, session.connector.requests_count, session.connector.connections_count
+
+
 class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('pages', nargs='?', type=int)
+        parser.add_argument('--no-keepalive', action='store_false', dest='keepalive',
+                            help='Open a connection per request, to compare against the pooled session')
+        parser.add_argument('--refresh', action='store_true',
+                            help='Revalidate pages and images of paintings already in the catalog and update the changed ones')
+        journal_group = parser.add_mutually_exclusive_group()
+        journal_group.add_argument('--resume', action='store_true',
+                                   help='Continue an interrupted crawl, skipping pages and images it has done')
+        journal_group.add_argument('--restart', action='store_true',
+                                   help='Forget an interrupted crawl and start over')
 
     def handle(self, *args, **options):
         pages = options["pages"]
+        journal = CrawlJournal(settings.PARSER_JOURNAL_FILE)
+        if journal.is_interrupted() and not (options['resume'] or options['restart']):
+            journal.close()
+            raise CommandError('The previous crawl was interrupted, pass --resume or --restart')
+        journal.start(resume=options['resume'])
+        http_cache = HTTPCache(settings.PARSER_HTTP_CACHE_DIR)
+
         loop = asyncio.get_event_loop()
-        pages = loop.run_until_complete(run_parser(pages))
+        started = time.monotonic()
+        pages, requests_count, connections_count = loop.run_until_complete(
+            crawl(journal, http_cache, pages, options['keepalive'], options['refresh']))
+        elapsed = time.monotonic() - started
         loop.close()
-
+        journal.finish()
+        failed_count = journal.count(FAILED)
+        journal.close()
+
+        self.stdout.write(f'{requests_count} request(s) over {connections_count} connection(s) in {elapsed:.1f} s')
+        self.stdout.write(f'{http_cache.not_modified_count} response(s) not modified, '
+                          f'{http_cache.modified_count} downloaded')
+        if failed_count:
+            self.stdout.write(self.style.WARNING(f'{failed_count} URL(s) failed, rerun to retry them'))
         self.stdout.write(self.style.SUCCESS(f'Successfully parse {pages} page(s)'))
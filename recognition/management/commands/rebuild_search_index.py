@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from recognition.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of paintings'
+
+    def handle(self, *args, **options):
+        count = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Successfully index {count} painting(s)'))
@@ -0,0 +1,29 @@
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+
+from recognition.derivatives import generate_derivatives
+from recognition.models import Painting
+from recognition.storage import is_hashed_name
+
+
+class Command(BaseCommand):
+    help = 'Move painting images stored before content-hashed names to their hashed names'
+
+    def handle(self, *args, **options):
+        queryset = Painting.objects.order_by('id').select_related('author').defer('embedding')
+        count = 0
+        for painting in queryset.iterator():
+            old_name = painting.image.name
+            if not old_name or is_hashed_name(old_name):
+                continue
+            storage = painting.image.storage
+            with storage.open(old_name, 'rb') as f:
+                image_data = f.read()
+            painting.image.name = storage.save(old_name, ContentFile(image_data))
+            painting.save(update_fields=('image', 'modified'))
+            storage.delete(old_name)
+            if painting.derivatives:
+                generate_derivatives(painting, image_data)
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully rehash {count} image(s)'))
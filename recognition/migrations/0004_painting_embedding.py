@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recognition', '0003_auto_20171021_1139'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='painting',
+            name='author',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='paintings', to='recognition.Author'),
+        ),
+        migrations.AddField(
+            model_name='painting',
+            name='embedding',
+            field=models.BinaryField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='painting',
+            name='embedded_at',
+            field=models.DateTimeField(db_index=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+import os
+
+from django.db import migrations, models
+
+PROGRAM_FILE = os.path.join(os.path.dirname(__file__), os.pardir, 'data', 'program.json')
+
+
+def load_program(apps, schema_editor):
+    # The program used to be hardcoded in ProgramAPIView
+    Exhibition = apps.get_model('recognition', 'Exhibition')
+    with open(PROGRAM_FILE, encoding='utf-8') as f:
+        program = json.load(f)
+    Exhibition.objects.bulk_create(
+        Exhibition(position=position, **exhibition)
+        for position, exhibition in enumerate(program)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recognition', '0005_modified'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Exhibition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=256)),
+                ('dates', models.CharField(max_length=256)),
+                ('picture', models.URLField(max_length=512)),
+                ('location', models.CharField(max_length=256)),
+                ('description', models.TextField()),
+                ('position', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ('position', 'id'),
+            },
+        ),
+        migrations.RunPython(load_program, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+SQLITE_TABLE = 'recognition_painting_fts'
+POSTGRESQL_TABLE = 'recognition_painting_search'
+
+
+def create_search_index(apps, schema_editor):
+    # Documents are filled by 0011_populate_painting_search and kept in sync by signals
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        # Columns hold stemmed text, rowid is the painting id
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE {SQLITE_TABLE} USING fts5(title, description, author)'
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            f'CREATE TABLE {POSTGRESQL_TABLE} ('
+            f'painting_id integer PRIMARY KEY REFERENCES recognition_painting (id) '
+            f'ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+            f'document tsvector NOT NULL)'
+        )
+        schema_editor.execute(
+            f'CREATE INDEX {POSTGRESQL_TABLE}_document ON {POSTGRESQL_TABLE} USING GIN (document)'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SQLITE_TABLE}')
+    elif vendor == 'postgresql':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {POSTGRESQL_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recognition', '0006_exhibition'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
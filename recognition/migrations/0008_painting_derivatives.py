@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recognition', '0007_painting_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='painting',
+            name='derivatives',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import recognition.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recognition', '0008_painting_derivatives'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='painting',
+            name='image',
+            field=models.ImageField(storage=recognition.storage.ContentHashStorage(), upload_to='paintings'),
+        ),
+    ]
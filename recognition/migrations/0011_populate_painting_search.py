@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from recognition.search import index_in_chunks
+
+
+def populate_search_index(apps, schema_editor):
+    # Paintings saved before 0007 have no search documents yet. Documents must be
+    # stemmed exactly like the queries, so the live stemmer is used on purpose
+    index_in_chunks(apps.get_model('recognition', 'Painting').objects.all(), using=schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recognition', '0010_exhibition_modified'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_search_index, migrations.RunPython.noop),
+    ]
@@ -1,16 +1,38 @@
 from django.db import models
 
+from recognition.storage import content_hash_storage
+
 
 class Author(models.Model):
     first_name = models.CharField(max_length=50, null=True)
     middle_name = models.CharField(max_length=50, null=True)
     last_name = models.CharField(max_length=50)
+    modified = models.DateTimeField(auto_now=True, db_index=True)
 
 
 class Painting(models.Model):
     author = models.ForeignKey(Author, related_name='paintings')
     title = models.CharField(max_length=256)
-    image = models.ImageField(upload_to='paintings')
+    image = models.ImageField(upload_to='paintings', storage=content_hash_storage)
     site_url = models.CharField(max_length=256, unique=True)
     years = models.CharField(max_length=256)
     description = models.TextField()
+    # Bottleneck vector of the image as float32 bytes, see recognition.embeddings
+    embedding = models.BinaryField(null=True, editable=False)
+    embedded_at = models.DateTimeField(null=True, editable=False, db_index=True)
+    # Names of scaled down image copies as JSON ``{format: {width: name}}``, see recognition.derivatives
+    derivatives = models.TextField(blank=True, default='', editable=False)
+    modified = models.DateTimeField(auto_now=True, db_index=True)
+
+
+class Exhibition(models.Model):
+    title = models.CharField(max_length=256)
+    dates = models.CharField(max_length=256)
+    picture = models.URLField(max_length=512)
+    location = models.CharField(max_length=256)
+    description = models.TextField()
+    position = models.PositiveIntegerField(default=0)
+    modified = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        ordering = ('position', 'id')
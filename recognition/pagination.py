@@ -0,0 +1,21 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class IdCursorPagination(CursorPagination):
+    """Keyset pagination on ``id``: no COUNT(*) and no OFFSET scans on deep pages."""
+    ordering = 'id'
+
+
+class LegacyPaginationMixin:
+    """Serve page-number pages to clients that still send ``?page=``, cursor pages otherwise."""
+    pagination_class = IdCursorPagination
+    legacy_pagination_class = PageNumberPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if self.legacy_pagination_class.page_query_param in self.request.query_params:
+                self._paginator = self.legacy_pagination_class()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from recognition.catalog import get_catalog_version
+from recognition.generations import get_generation, move_generation
+from recognition.serializers import parse_expand, parse_fields
+
+GENERATION_KEY = 'painting-payload-generation'
+
+
+class PaintingPayloadCache:
+    """Rendered painting payloads in the Django cache, keyed by painting id and host.
+
+    Every combination of ``?fields=`` and ``?expand=`` is cached separately.
+
+    A payload embeds its author and the author's other paintings, so any
+    catalog change invalidates every payload at once: keys hold the catalog
+    version, which every process sees change, and the generation, which saves
+    in this process move without waiting for the version. Older entries
+    simply expire.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+
+    def get(self, key):
+        return cache.get(key)
+
+    def set(self, key, data):
+        cache.set(key, data, self.timeout)
+
+    def invalidate(self):
+        move_generation(GENERATION_KEY)
+
+    def get_key(self, painting_id, request):
+        """Return the key of the payload, it must be taken before rendering.
+
+        A payload rendered while a save moves to a new generation then lands
+        in the old generation instead of being served as current. The catalog
+        version is memoized on ``request``, catalog_condition has usually paid
+        for it already.
+        """
+        fields = ','.join(parse_fields(request.GET) or ('all',))
+        expand = ','.join(parse_expand(request.GET))
+        return (f'painting-payload:{get_catalog_version(request)}:{get_generation(GENERATION_KEY)}:{painting_id}'
+                f':{request.get_host()}:{fields}:{expand}')
+
+
+painting_payload_cache = PaintingPayloadCache(timeout=settings.PAINTING_PAYLOAD_CACHE_TIMEOUT)
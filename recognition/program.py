@@ -0,0 +1,63 @@
+import gzip
+import hashlib
+import re
+
+from django.core.cache import cache
+from django.db.models import Count, Max
+from rest_framework.renderers import JSONRenderer
+
+from recognition.models import Exhibition
+from recognition.serializers import ExhibitionSerializer
+
+PROGRAM_CACHE_KEY_PREFIX = 'program-blob'
+
+accepts_gzip_re = re.compile(r'\bgzip\b')
+
+
+def accepts_gzip(request):
+    return bool(accepts_gzip_re.search(request.META.get('HTTP_ACCEPT_ENCODING', '')))
+
+
+def render_program():
+    """Render the program once into JSON bytes, their gzip and an ETag."""
+    data = {'data': ExhibitionSerializer(Exhibition.objects.all(), many=True).data}
+    content = JSONRenderer().render(data)
+    return {
+        'etag': hashlib.sha1(content).hexdigest(),
+        'content': content,
+        'gzip_content': gzip.compress(content, compresslevel=9),
+    }
+
+
+def get_program_version():
+    """Return the version of the program from one aggregate query.
+
+    Every process sees the change, including ones made by load_program.
+    """
+    state = Exhibition.objects.aggregate(count=Count('id'), max_id=Max('id'), modified=Max('modified'))
+    return '.'.join(str(value) for value in (
+        state['count'], state['max_id'], state['modified'] and state['modified'].timestamp(),
+    ))
+
+
+def get_program_blob(request=None):
+    """Return the blob of the current program, passing ``request`` memoizes it for the request."""
+    blob = getattr(request, '_program_blob', None)
+    if blob is not None:
+        return blob
+
+    # Blobs of older versions are never read again and get culled
+    cache_key = f'{PROGRAM_CACHE_KEY_PREFIX}:{get_program_version()}'
+    blob = cache.get(cache_key)
+    if blob is None:
+        blob = render_program()
+        cache.set(cache_key, blob, None)
+    if request is not None:
+        request._program_blob = blob
+    return blob
+
+
+def get_program_etag(request):
+    # Compressed and plain bodies are different representations
+    etag = get_program_blob(request)['etag']
+    return f'{etag}-gzip' if accepts_gzip(request) else etag
@@ -0,0 +1,264 @@
+import hashlib
+import logging
+import threading
+import time
+
+import numpy as np
+import tensorflow as tf
+from django.conf import settings
+from django.utils import timezone
+
+from recognition.batching import BatchDispatcher
+from recognition.embeddings import CLASSIFIER_MODE, EMBEDDING_MODE, get_embedding_index
+from scripts.label_image import load_graph, load_labels
+
+logger = logging.getLogger('tretyakov.recognition')
+
+IMAGE_SIGNATURES = (
+    (b'\x89PNG', 'png'),
+    (b'GIF8', 'gif'),
+    (b'BM', 'bmp'),
+)
+
+
+def guess_image_format(image_data):
+    for signature, image_format in IMAGE_SIGNATURES:
+        if image_data.startswith(signature):
+            return image_format
+    return 'jpeg'
+
+
+def get_files_digest(*file_names):
+    digest = hashlib.sha1()
+    for file_name in file_names:
+        with open(file_name, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_preprocessing_graph(input_height, input_width, input_mean, input_std):
+    """Build the decode/resize/normalize ops once, fed with raw image bytes.
+
+    Returns the finalized graph, the bytes placeholder and a mapping from image
+    format to the normalized output tensor.
+    """
+    graph = tf.Graph()
+    with graph.as_default():
+        image_data = tf.placeholder(tf.string, name='image_data')
+        decoded_images = {
+            'png': tf.image.decode_png(image_data, channels=3, name='png_reader'),
+            'gif': tf.squeeze(tf.image.decode_gif(image_data, name='gif_reader')),
+            'bmp': tf.image.decode_bmp(image_data, name='bmp_reader'),
+            'jpeg': tf.image.decode_jpeg(image_data, channels=3, name='jpeg_reader'),
+        }
+        outputs = {}
+        for image_format, image_reader in decoded_images.items():
+            float_caster = tf.cast(image_reader, tf.float32)
+            dims_expander = tf.expand_dims(float_caster, 0)
+            resized = tf.image.resize_bilinear(dims_expander, [input_height, input_width])
+            outputs[image_format] = tf.divide(tf.subtract(resized, [input_mean]), [input_std],
+                                              name=f'{image_format}_normalized')
+    graph.finalize()
+    return graph, image_data, outputs
+
+
+class Recognizer:
+    """Keeps the retrained graph, its labels and a session resident in memory."""
+
+    def __init__(self, model_file, label_file, input_layer, output_layer, bottleneck_layer,
+                 input_height, input_width, input_mean, input_std,
+                 mode=CLASSIFIER_MODE, batch_max_size=1, batch_max_wait=0):
+        self.model_file = model_file
+        self.label_file = label_file
+        self.input_layer = input_layer
+        self.output_layer = output_layer
+        self.bottleneck_layer = bottleneck_layer
+        self.input_height = input_height
+        self.input_width = input_width
+        self.input_mean = input_mean
+        self.input_std = input_std
+        self.mode = mode
+        self.batch_max_size = batch_max_size
+        self.batch_max_wait = batch_max_wait
+
+        self.graph = None
+        self.session = None
+        self.labels = None
+        self.input_tensor = None
+        self.output_tensor = None
+        self.bottleneck_tensor = None
+        self.preprocessing_graph = None
+        self.preprocessing_session = None
+        self.image_data_tensor = None
+        self.normalized_tensors = None
+        self.dispatcher = None
+        self._model_version = None
+
+        self.load_time = None
+        self.loaded_at = None
+        self.recognitions_count = 0
+        self.cold_recognitions_count = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            model_file=settings.RECOGNITION_MODEL_FILE,
+            label_file=settings.RECOGNITION_LABELS_FILE,
+            input_layer=settings.RECOGNITION_INPUT_LAYER,
+            output_layer=settings.RECOGNITION_OUTPUT_LAYER,
+            bottleneck_layer=settings.RECOGNITION_BOTTLENECK_LAYER,
+            input_height=settings.RECOGNITION_INPUT_HEIGHT,
+            input_width=settings.RECOGNITION_INPUT_WIDTH,
+            input_mean=settings.RECOGNITION_INPUT_MEAN,
+            input_std=settings.RECOGNITION_INPUT_STD,
+            mode=settings.RECOGNITION_MODE,
+            batch_max_size=settings.RECOGNITION_BATCH_MAX_SIZE,
+            batch_max_wait=settings.RECOGNITION_BATCH_MAX_WAIT,
+        )
+
+    @property
+    def model_version(self):
+        if self._model_version is None:
+            self._model_version = f'{self.mode}-{get_files_digest(self.model_file, self.label_file)[:16]}'
+        return self._model_version
+
+    @property
+    def is_warm(self):
+        return self.session is not None
+
+    def load(self):
+        """Load the model once; returns True if this call paid the load cost."""
+        if self.is_warm:
+            return False
+        with self._lock:
+            if self.is_warm:
+                return False
+            started = time.monotonic()
+            graph = load_graph(self.model_file)
+            input_tensor = graph.get_operation_by_name('import/' + self.input_layer).outputs[0]
+            output_tensor = graph.get_operation_by_name('import/' + self.output_layer).outputs[0]
+            # Classifier graphs need not have the bottleneck layer
+            bottleneck_tensor = self._get_bottleneck_tensor(graph) if self.mode == EMBEDDING_MODE else None
+            graph.finalize()
+            preprocessing_graph, image_data_tensor, normalized_tensors = build_preprocessing_graph(
+                self.input_height, self.input_width, self.input_mean, self.input_std,
+            )
+
+            self.labels = load_labels(self.label_file)
+            self.graph = graph
+            self.input_tensor = input_tensor
+            self.output_tensor = output_tensor
+            self.bottleneck_tensor = bottleneck_tensor
+            self.preprocessing_graph = preprocessing_graph
+            self.image_data_tensor = image_data_tensor
+            self.normalized_tensors = normalized_tensors
+            self.preprocessing_session = tf.Session(graph=preprocessing_graph)
+            self.dispatcher = self._create_dispatcher()
+            # Assigned last: a session means the recognizer is ready to serve
+            self.session = tf.Session(graph=graph)
+            self.load_time = time.monotonic() - started
+            self.loaded_at = timezone.now()
+        logger.info('Model %s loaded in %.3fs', self.model_file, self.load_time)
+        return True
+
+    def close(self):
+        with self._lock:
+            if self.dispatcher is not None:
+                # Let queued batches finish before their session goes away
+                self.dispatcher.close()
+            if self.session is not None:
+                self.session.close()
+                self.preprocessing_session.close()
+            self.graph = self.session = self.labels = None
+            self.input_tensor = self.output_tensor = self.bottleneck_tensor = None
+            self.preprocessing_graph = self.preprocessing_session = None
+            self.image_data_tensor = self.normalized_tensors = None
+            self.dispatcher = None
+
+    def _get_bottleneck_tensor(self, graph):
+        return graph.get_operation_by_name('import/' + self.bottleneck_layer).outputs[0]
+
+    def _create_dispatcher(self):
+        if self.batch_max_size <= 1:
+            return None
+        batch_dimension = self.input_tensor.shape[0].value
+        if batch_dimension is not None:
+            logger.warning('Input layer %s has a fixed batch size of %s, batching disabled',
+                           self.input_layer, batch_dimension)
+            return None
+        return BatchDispatcher(self.infer, self.batch_max_size, self.batch_max_wait)
+
+    def ops_count(self):
+        if not self.is_warm:
+            return 0
+        return len(self.graph.get_operations()) + len(self.preprocessing_graph.get_operations())
+
+    def preprocess(self, image_data):
+        normalized_tensor = self.normalized_tensors[guess_image_format(image_data)]
+        return self.preprocessing_session.run(normalized_tensor, {self.image_data_tensor: image_data})
+
+    def recognize(self, image_data):
+        """Return the label (or painting id in embedding mode) for an image."""
+        if self.load():
+            self.cold_recognitions_count += 1
+        self.recognitions_count += 1
+        image_tensor = self.preprocess(image_data)
+        if self.dispatcher is None:
+            result = self.infer([image_tensor])[0]
+        else:
+            result = self.dispatcher.submit(image_tensor)
+        if self.mode == EMBEDDING_MODE:
+            matches = get_embedding_index().search(result, k=1)
+            return matches[0][0] if matches else None
+        return result
+
+    def embed_image(self, image_data):
+        self.load()
+        return self.embed([self.preprocess(image_data)])[0]
+
+    def infer(self, image_tensors):
+        if self.mode == EMBEDDING_MODE:
+            return list(self.embed(image_tensors))
+        return self.classify(image_tensors)
+
+    def classify(self, image_tensors):
+        """Run a single inference over preprocessed images, one label per image."""
+        results = self.session.run(self.output_tensor, {self.input_tensor: np.concatenate(image_tensors)})
+        return [self.labels[image_results.argmax()] for image_results in results]
+
+    def embed(self, image_tensors):
+        """Return the bottleneck vectors of preprocessed images as rows of a matrix."""
+        if self.bottleneck_tensor is None:
+            # Classifier mode resolves the layer only when embeddings are asked for, e.g. by index_paintings
+            self.bottleneck_tensor = self._get_bottleneck_tensor(self.graph)
+        return self.session.run(self.bottleneck_tensor, {self.input_tensor: np.concatenate(image_tensors)})
+
+    def status(self):
+        return {
+            'warm': self.is_warm,
+            'model_file': self.model_file,
+            'mode': self.mode,
+            'model_version': self._model_version,
+            'load_time': self.load_time,
+            'loaded_at': self.loaded_at,
+            'recognitions_count': self.recognitions_count,
+            'cold_recognitions_count': self.cold_recognitions_count,
+            'ops_count': self.ops_count(),
+            'batching': self.dispatcher.status() if self.dispatcher else None,
+        }
+
+
+_recognizer = None
+_recognizer_lock = threading.Lock()
+
+
+def get_recognizer():
+    """Return the process-wide recognizer, creating it (but not loading it) on first use."""
+    global _recognizer
+    if _recognizer is None:
+        with _recognizer_lock:
+            if _recognizer is None:
+                _recognizer = Recognizer.from_settings()
+    return _recognizer
@@ -0,0 +1,163 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from recognition.models import Painting
+
+SQLITE_TABLE = 'recognition_painting_fts'
+POSTGRESQL_TABLE = 'recognition_painting_search'
+
+word_re = re.compile(r'\w+')
+
+# Snowball stemmer for Russian, see http://snowball.tartarus.org/algorithms/russian/stemmer.html
+rv_re = re.compile(r'^(.*?[аеиоуыэюя])(.*)$')
+perfective_gerund_re = re.compile(r'((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$')
+reflexive_re = re.compile(r'(с[яь])$')
+adjective_re = re.compile(r'(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$')
+participle_re = re.compile(r'((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$')
+verb_re = re.compile(
+    r'((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)'
+    r'|((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$'
+)
+noun_re = re.compile(
+    r'(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$'
+)
+derivational_re = re.compile(r'.*[^аеиоуыэюя]+[аеиоуыэюя].*ость?$')
+derivational_ending_re = re.compile(r'ость?$')
+superlative_re = re.compile(r'(ейше|ейш)$')
+
+
+def stem(word):
+    word = word.lower().replace('ё', 'е')
+    match = rv_re.match(word)
+    if not match:
+        return word
+    prefix, rv = match.groups()
+
+    without_gerund = perfective_gerund_re.sub('', rv, 1)
+    if without_gerund != rv:
+        rv = without_gerund
+    else:
+        rv = reflexive_re.sub('', rv, 1)
+        without_adjective = adjective_re.sub('', rv, 1)
+        if without_adjective != rv:
+            rv = participle_re.sub('', without_adjective, 1)
+        else:
+            without_verb = verb_re.sub('', rv, 1)
+            rv = noun_re.sub('', rv, 1) if without_verb == rv else without_verb
+
+    if rv.endswith('и'):
+        rv = rv[:-1]
+    if derivational_re.match(rv):
+        rv = derivational_ending_re.sub('', rv, 1)
+    if rv.endswith('ь'):
+        rv = rv[:-1]
+    else:
+        rv = superlative_re.sub('', rv, 1)
+        if rv.endswith('нн'):
+            rv = rv[:-1]
+    return prefix + rv
+
+
+def stem_text(text):
+    return ' '.join(stem(word) for word in word_re.findall(text or ''))
+
+
+def get_author_name(author):
+    return ' '.join(filter(None, (author.last_name, author.first_name, author.middle_name)))
+
+
+def index_paintings(paintings, using=None):
+    """Add or replace search documents of paintings, authors must be loaded with them.
+
+    ``using`` is the database connection, the default one unless given.
+    """
+    using = using or connection
+    paintings = list(paintings)
+    if not paintings:
+        return
+    vendor = using.vendor
+    with using.cursor() as cursor:
+        if vendor == 'sqlite':
+            cursor.executemany(f'DELETE FROM {SQLITE_TABLE} WHERE rowid = %s',
+                               [(painting.id,) for painting in paintings])
+            cursor.executemany(
+                f'INSERT INTO {SQLITE_TABLE} (rowid, title, description, author) VALUES (%s, %s, %s, %s)',
+                [(painting.id, stem_text(painting.title), stem_text(painting.description),
+                  stem_text(get_author_name(painting.author)))
+                 for painting in paintings],
+            )
+        elif vendor == 'postgresql':
+            cursor.executemany(
+                f"INSERT INTO {POSTGRESQL_TABLE} (painting_id, document) VALUES (%s, "
+                f"setweight(to_tsvector('russian', %s), 'A') || "
+                f"setweight(to_tsvector('russian', %s), 'B') || "
+                f"setweight(to_tsvector('russian', %s), 'C')) "
+                f"ON CONFLICT (painting_id) DO UPDATE SET document = EXCLUDED.document",
+                [(painting.id, painting.title, get_author_name(painting.author), painting.description)
+                 for painting in paintings],
+            )
+
+
+def remove_paintings(painting_ids):
+    if connection.vendor != 'sqlite':
+        # The PostgreSQL table cascades on painting deletion
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {SQLITE_TABLE} WHERE rowid = %s',
+                           [(painting_id,) for painting_id in painting_ids])
+
+
+def index_in_chunks(paintings, chunk_size=500, using=None):
+    """Index a queryset of paintings ``chunk_size`` at a time, returns how many were indexed."""
+    if using is not None:
+        paintings = paintings.using(using.alias)
+    chunk = []
+    count = 0
+    for painting in paintings.select_related('author').defer('embedding').order_by('id').iterator():
+        chunk.append(painting)
+        if len(chunk) == chunk_size:
+            index_paintings(chunk, using)
+            count += len(chunk)
+            chunk = []
+    index_paintings(chunk, using)
+    return count + len(chunk)
+
+
+def rebuild_index(chunk_size=500):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'DELETE FROM {SQLITE_TABLE}')
+        elif connection.vendor == 'postgresql':
+            cursor.execute(f'DELETE FROM {POSTGRESQL_TABLE}')
+    return index_in_chunks(Painting.objects.all(), chunk_size)
+
+
+def search_painting_ids(query, limit):
+    """Return ids of paintings matching ``query``, best ranked first."""
+    vendor = connection.vendor
+    if vendor == 'sqlite':
+        terms = [stem(word) for word in word_re.findall(query)]
+        if not terms:
+            return []
+        # Quoted prefix terms: stems are prefixes of word forms and quotes disable the query syntax
+        match = ' '.join(f'"{term}"*' for term in terms)
+        sql = (f'SELECT rowid FROM {SQLITE_TABLE} WHERE {SQLITE_TABLE} MATCH %s '
+               f'ORDER BY bm25({SQLITE_TABLE}, 10.0, 1.0, 5.0) LIMIT %s')
+        params = [match, limit]
+    elif vendor == 'postgresql':
+        sql = (f"SELECT painting_id FROM {POSTGRESQL_TABLE}, plainto_tsquery('russian', %s) query "
+               f"WHERE document @@ query ORDER BY ts_rank(document, query) DESC LIMIT %s")
+        params = [query, limit]
+    else:
+        condition = Q()
+        for word in word_re.findall(query):
+            condition &= (Q(title__icontains=word)
+                          | Q(description__icontains=word)
+                          | Q(author__last_name__icontains=word))
+        return list(Painting.objects.filter(condition).order_by('id').values_list('id', flat=True)[:limit])
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
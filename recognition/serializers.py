@@ -1,31 +1,98 @@
+from django.db.models import Count, Prefetch
 from rest_framework import serializers
 
-from recognition.models import Author, Painting
+from recognition.derivatives import get_srcset
+from recognition.models import Author, Exhibition, Painting
+
+EXPANDABLE = ('author', 'author.paintings')
+FULL_EXPAND = EXPANDABLE
+# Serializer fields computed from a differently named column
+FIELD_COLUMNS = {'srcset': 'derivatives'}
+
+
+def get_columns(fields):
+    return [FIELD_COLUMNS.get(field, field) for field in fields]
+
+
+def parse_fields(query_params):
+    """Painting fields requested with ``?fields=``, ``None`` means all of them."""
+    fields = query_params.get('fields')
+    if not fields:
+        return None
+    return tuple(field for field in PaintingSerializer.Meta.fields if field in fields.split(','))
+
+
+def parse_expand(query_params):
+    """Relations requested with ``?expand=``, ``author.paintings`` implies ``author``."""
+    expand = set(query_params.get('expand', '').split(','))
+    if 'author.paintings' in expand:
+        expand.add('author')
+    return tuple(relation for relation in EXPANDABLE if relation in expand)
+
+
+def shape_payload(payload, fields=None, expand=()):
+    """Cut a payload rendered with at least ``expand`` down to ``fields`` and ``expand``."""
+    author = payload['author']
+    if 'author' not in expand:
+        author = author['id']
+    elif 'author.paintings' not in expand:
+        author = {name: value for name, value in author.items() if name != 'paintings'}
+    payload = dict(payload, author=author)
+    if fields is not None:
+        payload = {name: value for name, value in payload.items() if name in fields}
+    return payload
+
+
+class SrcsetField(serializers.Field):
+    """``srcset`` values of the painting image derivatives by format."""
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = 'derivatives'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        storage = Painting._meta.get_field('image').storage
+        return get_srcset(value, storage, self.context.get('request'))
 
 
 class _PaintingSerializer(serializers.ModelSerializer):
+    srcset = SrcsetField()
+
     class Meta:
         model = Painting
-        fields = ('id', 'title', 'image', 'years', 'description')
+        fields = ('id', 'title', 'image', 'srcset', 'years', 'description')
 
 
 class AuthorSerializer(serializers.ModelSerializer):
+    """Author summary; the list of paintings is only included for ``author.paintings``.
+
+    ``paintings_count`` is expected to be annotated on the author.
+    """
     full_name = serializers.SerializerMethodField()
+    paintings_count = serializers.IntegerField(read_only=True)
     paintings = serializers.SerializerMethodField()
 
     class Meta:
         model = Author
-        fields = ('full_name', 'paintings')
+        fields = ('id', 'full_name', 'paintings_count', 'paintings')
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.annotate(paintings_count=Count('paintings'))
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if 'author.paintings' not in self.context.get('expand', FULL_EXPAND):
+            self.fields.pop('paintings')
 
     def get_full_name(self, author):
         return f'{author.last_name} {author.first_name} {author.middle_name}'
 
     def get_paintings(self, author):
+        # Filter in memory, so paintings prefetched by setup_eager_loading are reused
         exclude_painting_id = self.context.get('exclude_painting_id')
-        if exclude_painting_id:
-            instance = author.paintings.exclude(id=exclude_painting_id)
-        else:
-            instance = author.paintings
+        instance = [painting for painting in author.paintings.all() if painting.id != exclude_painting_id]
         serializer = _PaintingSerializer(
             instance=instance,
             many=True,
@@ -36,17 +103,128 @@ class AuthorSerializer(serializers.ModelSerializer):
 
 
 class PaintingSerializer(serializers.ModelSerializer):
+    """Painting with the author as an id unless ``expand`` in the context asks for more.
+
+    ``fields`` and ``expand`` context values come from ``parse_fields`` and
+    ``parse_expand``; without them the author and its paintings are expanded.
+    """
     author = serializers.SerializerMethodField()
+    srcset = SrcsetField()
 
     class Meta:
         model = Painting
-        fields = ('id', 'author', 'title', 'image', 'years', 'description')
+        fields = ('id', 'author', 'title', 'image', 'srcset', 'years', 'description')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = self.context.get('fields')
+        if fields is not None:
+            for field in set(self.fields) - set(fields):
+                self.fields.pop(field)
+
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None, expand=FULL_EXPAND):
+        """Load only the columns and relations the requested representation needs."""
+        fields = PaintingSerializer.Meta.fields if fields is None else fields
+        columns = ['id'] + get_columns(field for field in fields if field != 'id')
+        if 'author' in fields and 'author' in expand:
+            columns.extend(('author__first_name', 'author__middle_name', 'author__last_name'))
+            queryset = queryset.select_related('author').annotate(author_paintings_count=Count('author__paintings'))
+            if 'author.paintings' in expand:
+                siblings = Painting.objects.only(*get_columns(_PaintingSerializer.Meta.fields), 'author').order_by('id')
+                queryset = queryset.prefetch_related(Prefetch('author__paintings', queryset=siblings))
+        return queryset.only(*columns)
 
     def get_author(self, obj):
-        context = self.context
-        context['exclude_painting_id'] = obj.id
+        if 'author' not in self.context.get('expand', FULL_EXPAND):
+            return obj.author_id
+        context = dict(self.context, exclude_painting_id=obj.id)
+        obj.author.paintings_count = obj.author_paintings_count
         return AuthorSerializer(obj.author, context=context).data
 
 
+class PaintingRowsSerializer:
+    """Read-only fast path of ``PaintingSerializer(many=True)`` over ``values()`` rows.
+
+    ``setup_queryset`` turns a painting queryset into dict rows, which can be
+    paginated as usual; ``serialize`` builds payloads equal to what
+    PaintingSerializer renders for the same ``fields``, ``expand`` and request,
+    without instantiating models or going through DRF fields.
+    """
+
+    def __init__(self, fields=None, expand=FULL_EXPAND, request=None):
+        self.fields = PaintingSerializer.Meta.fields if fields is None else fields
+        self.expand_author = 'author' in self.fields and 'author' in expand
+        self.expand_author_paintings = self.expand_author and 'author.paintings' in expand
+        self.request = request
+        self.storage = Painting._meta.get_field('image').storage
+
+    def setup_queryset(self, queryset):
+        columns = ['id'] + get_columns(field for field in self.fields if field not in ('id', 'author'))
+        if 'author' in self.fields:
+            columns.append('author_id')
+        if self.expand_author:
+            columns.extend(('author__first_name', 'author__middle_name', 'author__last_name'))
+            queryset = queryset.annotate(author_paintings_count=Count('author__paintings'))
+            columns.append('author_paintings_count')
+        return queryset.values(*columns)
+
+    def serialize(self, rows):
+        rows = list(rows)
+        siblings = {}
+        if self.expand_author_paintings:
+            author_ids = {row['author_id'] for row in rows}
+            sibling_rows = (Painting.objects.filter(author_id__in=author_ids).order_by('id')
+                            .values_list('author_id', *get_columns(_PaintingSerializer.Meta.fields)))
+            for author_id, *values in sibling_rows:
+                painting = dict(zip(_PaintingSerializer.Meta.fields, values))
+                painting['image'] = self.get_image_url(painting['image'])
+                painting['srcset'] = get_srcset(painting['srcset'], self.storage, self.request)
+                siblings.setdefault(author_id, []).append(painting)
+
+        fields = self.fields
+        payloads = []
+        for row in rows:
+            payload = {}
+            for field in fields:
+                if field == 'author':
+                    payload['author'] = self.get_author(row, siblings) if self.expand_author else row['author_id']
+                elif field == 'image':
+                    payload['image'] = self.get_image_url(row['image'])
+                elif field == 'srcset':
+                    payload['srcset'] = get_srcset(row['derivatives'], self.storage, self.request)
+                else:
+                    payload[field] = row[field]
+            payloads.append(payload)
+        return payloads
+
+    def get_author(self, row, siblings):
+        author = {
+            'id': row['author_id'],
+            'full_name': f'{row["author__last_name"]} {row["author__first_name"]} {row["author__middle_name"]}',
+            'paintings_count': row['author_paintings_count'],
+        }
+        if self.expand_author_paintings:
+            painting_id = row['id']
+            author['paintings'] = [painting for painting in siblings.get(row['author_id'], ())
+                                   if painting['id'] != painting_id]
+        return author
+
+    def get_image_url(self, name):
+        # Same as ImageField.to_representation with use_url
+        if not name:
+            return None
+        url = self.storage.url(name)
+        if self.request is not None:
+            return self.request.build_absolute_uri(url)
+        return url
+
+
+class ExhibitionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Exhibition
+        fields = ('title', 'dates', 'picture', 'location', 'description')
+
+
 class RecognizeSerializer(serializers.Serializer):
     file = serializers.FileField()
@@ -0,0 +1,49 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from recognition.cache import get_recognition_cache
+from recognition.embeddings import get_embedding_index
+from recognition.lookup import label_lookup_registry
+from recognition.models import Author, Painting
+from recognition.payloads import painting_payload_cache
+from recognition.search import index_paintings, remove_paintings
+
+
+@receiver(post_delete, sender=Painting)
+def remove_painting_embedding(sender, instance, **kwargs):
+    get_embedding_index().remove(instance.id)
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+@receiver(post_save, sender=Painting)
+@receiver(post_delete, sender=Painting)
+def invalidate_recognition_results(sender, **kwargs):
+    # Cached responses embed the painting, its author and the author's paintings
+    get_recognition_cache().invalidate()
+    label_lookup_registry.mark_stale()
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+@receiver(post_save, sender=Painting)
+@receiver(post_delete, sender=Painting)
+def invalidate_painting_payloads(sender, **kwargs):
+    painting_payload_cache.invalidate()
+
+
+@receiver(post_save, sender=Painting)
+def index_painting(sender, instance, **kwargs):
+    index_paintings([instance])
+
+
+@receiver(post_delete, sender=Painting)
+def remove_painting_document(sender, instance, **kwargs):
+    remove_paintings([instance.id])
+
+
+@receiver(post_save, sender=Author)
+def index_author_paintings(sender, instance, **kwargs):
+    # Documents include the author name
+    index_paintings(instance.paintings.select_related('author').defer('embedding'))
+
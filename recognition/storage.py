@@ -0,0 +1,42 @@
+import hashlib
+import os
+import posixpath
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASH_LENGTH = 32
+hashed_name_re = re.compile(r'(^|/)[0-9a-f]{%d}(\.\w+)?$' % HASH_LENGTH)
+
+
+def is_hashed_name(name):
+    return bool(hashed_name_re.search(name))
+
+
+@deconstructible
+class ContentHashStorage(FileSystemStorage):
+    """FileSystemStorage keeping files under the hash of their content.
+
+    ``paintings/Title.JPG`` is stored as ``paintings/<sha256 prefix>.jpg``:
+    a name never points to different bytes, so its URL can be cached forever,
+    and saving the same content twice reuses the stored file.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        _, ext = os.path.splitext(name)
+        name = posixpath.join(posixpath.dirname(name), f'{digest.hexdigest()[:HASH_LENGTH]}{ext.lower()}')
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
+
+
+content_hash_storage = ContentHashStorage()
@@ -1,3 +1,763 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from recognition.ann import IVFPQIndex
+from recognition.batching import BatchDispatcher
+from recognition.cache import RecognitionCache
+from recognition.derivatives import generate_derivatives
+from recognition.embeddings import CatalogEmbeddingIndex, EmbeddingIndex
+from recognition.export import iter_painting_lines
+from recognition.httpcache import HTTPCache, fetch_page, is_image_unchanged
+from recognition.ingest import PaintingBatchWriter, store_image_files
+from recognition.journal import CrawlJournal
+from recognition.models import Author, Exhibition, Painting
+from recognition.pagination import IdCursorPagination
+from recognition.payloads import painting_payload_cache
+from recognition.serializers import FULL_EXPAND, PaintingRowsSerializer, PaintingSerializer
+from recognition.storage import ContentHashStorage
+
+
+def get_rss_bytes():
+    with open('/proc/self/statm') as f:
+        resident_pages = int(f.read().split()[1])
+    return resident_pages * os.sysconf('SC_PAGE_SIZE')
+
+
+def make_image_data(image_format='JPEG', size=(640, 480)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color=(120, 80, 40)).save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+@unittest.skipUnless(os.environ.get('RECOGNITION_SOAK_TEST'), 'set RECOGNITION_SOAK_TEST=1 to run')
+@unittest.skipUnless(os.path.exists(settings.RECOGNITION_MODEL_FILE), 'retrained model is missing')
+class RecognizerSoakTest(SimpleTestCase):
+    recognitions_count = 10000
+    warmup_count = 100
+    # Allocator noise is expected, unbounded growth per request is not
+    max_rss_growth = 32 * 1024 * 1024
+
+    def test_rss_and_ops_count_stay_flat(self):
+        from recognition.recognizer import Recognizer
+
+        recognizer = Recognizer.from_settings()
+        self.addCleanup(recognizer.close)
+        images = [make_image_data(image_format) for image_format in ('JPEG', 'PNG', 'BMP', 'GIF')]
+
+        for i in range(self.warmup_count):
+            recognizer.recognize(images[i % len(images)])
+        ops_count = recognizer.ops_count()
+        rss = get_rss_bytes()
+
+        for i in range(self.recognitions_count):
+            recognizer.recognize(images[i % len(images)])
+
+        self.assertEqual(recognizer.ops_count(), ops_count)
+        self.assertLess(get_rss_bytes() - rss, self.max_rss_growth)
+        self.assertEqual(recognizer.cold_recognitions_count, 1)
+
+
+class RecognizeUploadTest(TestCase):
+    def test_oversized_upload_is_rejected(self):
+        with self.settings(RECOGNITION_MAX_UPLOAD_SIZE=100):
+            upload = SimpleUploadedFile('painting.jpg', make_image_data())
+            response = self.client.post('/recognition/recognize', {'file': upload})
+
+        self.assertEqual(response.status_code, 413)
+        self.assertIn('100 bytes', response.json()['detail'])
+
+    def test_empty_embedding_index_is_not_found(self):
+        recognizer = mock.Mock(model_version='embedding-test', recognize=mock.Mock(return_value=None))
+        upload = SimpleUploadedFile('painting.jpg', make_image_data())
+        with mock.patch('recognition.views.get_recognizer', return_value=recognizer):
+            response = self.client.post('/recognition/recognize', {'file': upload})
+
+        self.assertEqual(response.status_code, 404)
+
+
+class BatchDispatcherTest(SimpleTestCase):
+    def test_concurrent_submits_share_a_batch(self):
+        batches = []
+
+        def run_batch(items):
+            batches.append(items)
+            return [item * 2 for item in items]
+
+        dispatcher = BatchDispatcher(run_batch, max_batch_size=4, max_wait=0.5)
+        results = {}
+
+        def submit(item):
+            results[item] = dispatcher.submit(item)
+
+        threads = [threading.Thread(target=submit, args=(item,)) for item in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, {0: 0, 1: 2, 2: 4, 3: 6})
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(dispatcher.items_count, 4)
+
+    def test_failed_batch_raises_in_every_caller(self):
+        def run_batch(items):
+            raise ValueError('broken model')
+
+        dispatcher = BatchDispatcher(run_batch, max_batch_size=2, max_wait=0)
+        with self.assertRaises(ValueError):
+            dispatcher.submit(1)
+
+    def test_close_stops_worker_thread(self):
+        dispatcher = BatchDispatcher(lambda items: items, max_batch_size=4, max_wait=0.01)
+        self.assertEqual(dispatcher.submit(1), 1)
+        thread = dispatcher._thread
+
+        dispatcher.close()
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(dispatcher.submit(2), 2)
+        dispatcher.close()
+
+
+class EmbeddingIndexTest(SimpleTestCase):
+    def setUp(self):
+        self.vectors = np.random.RandomState(0).normal(size=(10, 8)).astype(np.float32)
+        self.index = EmbeddingIndex(dimension=8, capacity=2)
+        for painting_id, vector in enumerate(self.vectors, start=1):
+            self.index.add(painting_id, vector)
+
+    def test_search_returns_most_similar_first(self):
+        matches = self.index.search(self.vectors[3] * 2, k=3)
+        self.assertEqual(len(matches), 3)
+        self.assertEqual(matches[0][0], 4)
+        self.assertAlmostEqual(matches[0][1], 1, places=5)
+        self.assertEqual([score for _, score in matches], sorted((score for _, score in matches), reverse=True))
+
+    def test_remove_keeps_other_rows(self):
+        self.index.remove(4)
+        self.assertEqual(len(self.index), 9)
+        self.assertNotEqual(self.index.search(self.vectors[3], k=1)[0][0], 4)
+        self.assertEqual(self.index.search(self.vectors[9], k=1)[0][0], 10)
+
+
+class IVFPQIndexTest(SimpleTestCase):
+    def setUp(self):
+        random = np.random.RandomState(0)
+        clusters = random.normal(size=(16, 32))
+        self.vectors = (clusters[random.randint(16, size=2000)] + random.normal(scale=0.3, size=(2000, 32)))
+        self.vectors = self.vectors.astype(np.float32)
+        self.ids = np.arange(1, 2001)
+        self.index = IVFPQIndex.train(self.ids, self.vectors, nlist=16, subquantizers=8, iterations=10,
+                                      built_at='2026-01-01T00:00:00+00:00')
+
+    def test_recall(self):
+        queries = range(0, 2000, 20)
+        found = sum(self.index.search(self.vectors[row], k=1)[0][0] == self.ids[row] for row in queries)
+        self.assertGreaterEqual(found / len(queries), 0.95)
+
+    def test_save_and_load(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.index.save(directory.name)
+        loaded = IVFPQIndex.load(directory.name, nprobe=self.index.nprobe, refine_factor=self.index.refine_factor)
+
+        self.assertEqual(len(loaded), len(self.index))
+        self.assertEqual(loaded.built_at, self.index.built_at)
+        for row in (0, 500, 1999):
+            self.assertEqual(loaded.search(self.vectors[row], k=5), self.index.search(self.vectors[row], k=5))
+
+    def test_reembedded_painting_hides_its_ann_entry(self):
+        catalog_index = CatalogEmbeddingIndex(dimension=32, refresh_interval=float('inf'), ann_index=self.index)
+        # Re-embedded far from its old vector, the painting must not match by its stale ANN entry
+        catalog_index.add(1, -self.vectors[0])
+        catalog_index.add(2, self.vectors[1])
+
+        self.assertNotEqual(catalog_index.search(self.vectors[0], k=1)[0][0], 1)
+        self.assertEqual([painting_id for painting_id, _ in catalog_index.search(self.vectors[0], k=10)].count(1), 0)
+
+
+class RecognitionCacheTest(SimpleTestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = RecognitionCache(max_entries=2)
+        cache.set('a', {'painting_id': 1})
+        cache.set('b', {'painting_id': 2})
+        cache.get('a')
+        cache.set('c', {'painting_id': 3})
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), {'painting_id': 1})
+        self.assertEqual(cache.status()['hits'], 2)
+        self.assertEqual(cache.status()['misses'], 1)
+
+    def test_file_tier_survives_eviction(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = RecognitionCache(max_entries=1, directory=directory)
+            cache.set('a', {'painting_id': 1})
+            cache.set('b', {'painting_id': 2})
+
+            self.assertEqual(cache.get('a'), {'painting_id': 1})
+            self.assertEqual(cache.status()['file_hits'], 1)
+
+    def test_invalidate_reaches_other_instances(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = RecognitionCache(max_entries=2, directory=directory)
+            other_cache = RecognitionCache(max_entries=2, directory=directory)
+            cache.set('a', {'painting_id': 1})
+            self.assertEqual(other_cache.get('a'), {'painting_id': 1})
+
+            other_cache.invalidate()
+
+            self.assertIsNone(cache.get('a'))
+            self.assertIsNone(other_cache.get('a'))
+            cache.set('b', {'painting_id': 2})
+            # Files of the old generation are gone
+            self.assertEqual(len(os.listdir(directory)), 1)
+
+
+def create_paintings(author, count):
+    first_id = Painting.objects.count() + 1
+    return [
+        Painting.objects.create(
+            author=author,
+            title=f'Painting {painting_id}',
+            image=f'paintings/{painting_id}.jpg',
+            site_url=f'https://example.com/{painting_id}',
+            years='1880',
+            description='Description',
+        )
+        for painting_id in range(first_id, first_id + count)
+    ]
+
+
+class PaintingQueriesTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.authors = [Author.objects.create(last_name=f'Author {i}') for i in range(3)]
+        for author in self.authors:
+            create_paintings(author, 2)
+
+    def test_list_query_count_does_not_depend_on_author_paintings(self):
+        # Catalog version aggregates, paintings with authors and prefetched author paintings
+        params = {'expand': 'author.paintings'}
+        with self.assertNumQueries(4):
+            self.client.get('/recognition/painting/', params)
+        for author in self.authors:
+            create_paintings(author, 10)
+        with self.assertNumQueries(4):
+            response = self.client.get('/recognition/painting/', params)
+
+        painting = response.json()['results'][0]
+        self.assertEqual(len(painting['author']['paintings']), 11)
+        self.assertNotIn(painting['id'], [sibling['id'] for sibling in painting['author']['paintings']])
+
+    def test_retrieve_query_count_does_not_depend_on_author_paintings(self):
+        painting = create_paintings(self.authors[0], 10)[0]
+        with self.assertNumQueries(4):
+            response = self.client.get(f'/recognition/painting/{painting.id}/', {'expand': 'author.paintings'})
+        self.assertEqual(len(response.json()['author']['paintings']), 11)
+
+
+class PaintingPayloadCacheTest(TestCase):
+    def test_payload_rendered_across_invalidation_is_not_served(self):
+        request = APIRequestFactory().get('/recognition/painting/1/')
+        cache_key = painting_payload_cache.get_key(1, request)
+        painting_payload_cache.invalidate()
+        painting_payload_cache.set(cache_key, {'id': 1})
+
+        self.assertIsNone(painting_payload_cache.get(painting_payload_cache.get_key(1, request)))
+
+    def test_edit_without_signals_is_not_served_stale(self):
+        painting = create_paintings(Author.objects.create(last_name='Author'), 1)[0]
+        url = f'/recognition/painting/{painting.id}/'
+        self.client.get(url)
+        # Another process: no signal reaches this one
+        Painting.objects.filter(id=painting.id).update(title='Renamed', modified=timezone.now())
+
+        self.assertEqual(self.client.get(url).json()['title'], 'Renamed')
+
+
+class PaintingSparseFieldsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = Author.objects.create(last_name='Author', first_name='Ivan')
+        self.painting = create_paintings(self.author, 3)[0]
+        self.url = f'/recognition/painting/{self.painting.id}/'
+
+    def test_author_is_a_reference_by_default(self):
+        # Catalog version aggregates and the painting, no author or sibling queries
+        with self.assertNumQueries(3):
+            data = self.client.get(self.url).json()
+        self.assertEqual(data['author'], self.author.id)
+
+    def test_fields_limit_payload(self):
+        data = self.client.get(self.url, {'fields': 'id,title'}).json()
+        self.assertEqual(data, {'id': self.painting.id, 'title': self.painting.title})
+
+    def test_expand_author_without_paintings(self):
+        data = self.client.get(self.url, {'expand': 'author'}).json()
+        self.assertEqual(data['author'], {'id': self.author.id, 'full_name': 'Author Ivan None', 'paintings_count': 3})
+
+    def test_expand_author_paintings(self):
+        data = self.client.get(self.url, {'expand': 'author.paintings'}).json()
+        self.assertEqual(len(data['author']['paintings']), 2)
+
+
+class AuthorTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = Author.objects.create(last_name='Author')
+        self.paintings = create_paintings(self.author, 5)
+
+    def test_author_has_paintings_count(self):
+        data = self.client.get(f'/recognition/author/{self.author.id}/').json()
+        self.assertEqual(data, {'id': self.author.id, 'full_name': 'Author None None', 'paintings_count': 5})
+
+    def test_author_paintings_are_paginated(self):
+        with mock.patch.object(IdCursorPagination, 'page_size', 2):
+            data = self.client.get(f'/recognition/author/{self.author.id}/paintings/').json()
+        self.assertEqual([painting['id'] for painting in data['results']], [p.id for p in self.paintings[:2]])
+        self.assertIsNotNone(data['next'])
+
+    def test_unknown_author_paintings(self):
+        response = self.client.get('/recognition/author/0/paintings/')
+        self.assertEqual(response.status_code, 404)
+
+
+class PaintingPaginationTest(TestCase):
+    def setUp(self):
+        author = Author.objects.create(last_name='Author')
+        self.paintings = create_paintings(author, 5)
+
+    def test_cursor_pages_cover_catalog_without_count(self):
+        with mock.patch.object(IdCursorPagination, 'page_size', 2):
+            ids = []
+            url = '/recognition/painting/'
+            while url:
+                data = self.client.get(url).json()
+                self.assertNotIn('count', data)
+                ids.extend(painting['id'] for painting in data['results'])
+                url = data['next']
+        self.assertEqual(ids, [painting.id for painting in self.paintings])
+
+    def test_page_number_is_kept_for_legacy_clients(self):
+        data = self.client.get('/recognition/painting/', {'page': 1}).json()
+        self.assertEqual(data['count'], 5)
+        self.assertEqual(len(data['results']), 5)
+
+
+class PaintingConditionalRequestsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = Author.objects.create(last_name='Author')
+        self.painting = create_paintings(self.author, 1)[0]
+        self.url = f'/recognition/painting/{self.painting.id}/'
+
+    def test_matching_etag_is_not_modified(self):
+        response = self.client.get(self.url)
+
+        # Only the catalog version aggregates run
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes_with_catalog(self):
+        etag = self.client.get(self.url)['ETag']
+        self.author.first_name = 'Ivan'
+        self.author.save()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_deletion_is_not_hidden_by_if_modified_since(self):
+        other_painting = create_paintings(self.author, 1)[0]
+        response = self.client.get('/recognition/painting/')
+        self.assertFalse(response.has_header('Last-Modified'))
+        other_painting.delete()
+
+        response = self.client.get('/recognition/painting/', HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+
+
+class ProgramTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_program_is_served_from_prerendered_blob(self):
+        response = self.client.get('/recognition/program')
+        self.assertEqual(len(json.loads(response.content.decode())['data']), 4)
+
+        # Only the program version aggregate runs
+        with self.assertNumQueries(1):
+            response = self.client.get('/recognition/program', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(len(json.loads(gzip.decompress(response.content).decode())['data']), 4)
+
+        response = self.client.get('/recognition/program', HTTP_IF_NONE_MATCH=response['ETag'],
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 304)
+
+    def test_program_is_rerendered_on_change(self):
+        self.client.get('/recognition/program')
+        Exhibition.objects.create(title='New', dates='2018', picture='https://example.com/1.jpg',
+                                  location='Krymsky Val', description='', position=10)
+
+        data = json.loads(self.client.get('/recognition/program').content.decode())['data']
+        self.assertEqual(data[-1]['title'], 'New')
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        self.author = Author.objects.create(last_name='Васнецов', first_name='Виктор')
+        self.paintings = create_paintings(self.author, 3)
+        self.paintings[0].title = 'Богатыри'
+        self.paintings[0].save()
+        self.paintings[1].description = 'Три богатыря на заставе'
+        self.paintings[1].save()
+
+    def test_word_forms_match_and_title_ranks_first(self):
+        data = self.client.get('/recognition/search', {'q': 'богатырь'}).json()
+        self.assertEqual([painting['id'] for painting in data['results']],
+                         [self.paintings[0].id, self.paintings[1].id])
+
+    def test_author_rename_is_indexed(self):
+        self.author.last_name = 'Репин'
+        self.author.save()
+        self.assertEqual(self.client.get('/recognition/search', {'q': 'Васнецова'}).json()['count'], 0)
+        self.assertEqual(self.client.get('/recognition/search', {'q': 'Репина'}).json()['count'], 3)
+
+    def test_deleted_painting_is_not_found(self):
+        self.paintings[0].delete()
+        data = self.client.get('/recognition/search', {'q': 'богатыри'}).json()
+        self.assertEqual([painting['id'] for painting in data['results']], [self.paintings[1].id])
+
+
+class PaintingRowsSerializerTest(TestCase):
+    def setUp(self):
+        self.authors = [Author.objects.create(last_name=f'Author {i}', first_name='Ivan') for i in range(2)]
+        for author in self.authors:
+            create_paintings(author, 3)
+        self.request = APIRequestFactory().get('/recognition/painting/')
+
+    def test_output_matches_painting_serializer(self):
+        queryset = Painting.objects.order_by('id')
+        for fields in (None, ('id', 'author'), ('title', 'image')):
+            for expand in ((), ('author',), FULL_EXPAND):
+                paintings = PaintingSerializer.setup_eager_loading(queryset, fields, expand)
+                context = {'request': self.request, 'fields': fields, 'expand': expand}
+                expected = JSONRenderer().render(PaintingSerializer(paintings, many=True, context=context).data)
+
+                rows_serializer = PaintingRowsSerializer(fields, expand, self.request)
+                rows = rows_serializer.setup_queryset(queryset)
+                self.assertEqual(JSONRenderer().render(rows_serializer.serialize(rows)), expected)
+
+
+class DerivativesTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = self.settings(MEDIA_ROOT=media_root.name, PAINTING_DERIVATIVE_WIDTHS=(320, 640, 1280))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.painting = create_paintings(Author.objects.create(last_name='Author'), 1)[0]
+        self.painting.image.save('painting.jpg', ContentFile(make_image_data(size=(1000, 500))))
+
+    def test_smaller_widths_are_generated_in_every_format(self):
+        derivatives = generate_derivatives(self.painting)
+
+        self.assertEqual(set(derivatives), {'jpeg', 'webp'})
+        self.assertEqual(set(derivatives['webp']), {'320', '640'})
+        with self.painting.image.storage.open(derivatives['webp']['320']) as f:
+            self.assertEqual(Image.open(f).size, (320, 160))
+
+    def test_srcset_is_exposed(self):
+        generate_derivatives(self.painting)
+        data = self.client.get(f'/recognition/painting/{self.painting.id}/').json()
+
+        url = 'http://testserver/media/derivatives/[0-9a-f]{32}'
+        self.assertRegex(data['srcset']['jpeg'], f'^{url}\\.jpg 320w, {url}\\.jpg 640w$')
+
+    def test_replaced_derivatives_are_deleted(self):
+        storage = self.painting.image.storage
+        old_derivatives = generate_derivatives(self.painting)
+        with self.settings(PAINTING_DERIVATIVE_QUALITY=50):
+            new_derivatives = generate_derivatives(self.painting)
+
+        self.assertFalse(storage.exists(old_derivatives['jpeg']['320']))
+        self.assertTrue(storage.exists(new_derivatives['jpeg']['320']))
+
+
+class MediaTest(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = self.settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.storage = ContentHashStorage()
+
+    def test_same_content_is_stored_once(self):
+        image_data = make_image_data()
+        name = self.storage.save('paintings/Утро в сосновом лесу.JPG', ContentFile(image_data))
+
+        self.assertRegex(name, r'^paintings/[0-9a-f]{32}\.jpg$')
+        self.assertEqual(self.storage.save('paintings/copy.jpg', ContentFile(image_data)), name)
+        self.assertNotEqual(self.storage.save('paintings/other.jpg', ContentFile(make_image_data(size=(1, 1)))), name)
+
+    def test_hashed_names_are_immutable(self):
+        name = self.storage.save('paintings/painting.jpg', ContentFile(make_image_data()))
+        response = self.client.get(f'/media/{name}')
+
+        self.assertEqual(b''.join(response.streaming_content), make_image_data())
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('immutable', response['Cache-Control'])
+
+        FileSystemStorage().save('paintings/legacy.jpg', ContentFile(make_image_data()))
+        self.assertNotIn('immutable', self.client.get('/media/paintings/legacy.jpg')['Cache-Control'])
+
+    def test_web_server_sends_the_bytes(self):
+        name = self.storage.save('paintings/painting.jpg', ContentFile(make_image_data()))
+        with self.settings(MEDIA_SERVE_MODE='x-accel-redirect'):
+            response = self.client.get(f'/media/{name}')
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{name}')
+        self.assertEqual(response.content, b'')
+
+    def test_paths_outside_media_root_are_not_served(self):
+        self.assertEqual(self.client.get('/media/../settings.py').status_code, 404)
+
+
+class ExportTest(TestCase):
+    def setUp(self):
+        self.author = Author.objects.create(last_name='Author')
+        self.paintings = create_paintings(self.author, 5)
+
+    def test_catalog_is_exported_in_chunks(self):
+        chunks = list(iter_painting_lines(expand=('author',), chunk_size=2))
+
+        self.assertEqual(len(chunks), 3)
+        lines = b''.join(chunks).decode().splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [painting.id for painting in self.paintings])
+        self.assertEqual(json.loads(lines[0])['author']['paintings_count'], 5)
+
+    def test_export_is_gzipped_when_accepted(self):
+        response = self.client.get('/recognition/export', {'fields': 'id,title'}, HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual(json.loads(lines[-1]), {'id': self.paintings[-1].id, 'title': self.paintings[-1].title})
+
+
+class CrawlJournalTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.file_name = os.path.join(directory.name, 'journal.sqlite3')
+
+    def test_resume_keeps_done_urls(self):
+        journal = CrawlJournal(self.file_name)
+        journal.start()
+        journal.record('https://example.com/list', 'list', 'done', 'hash', ['https://example.com/1'])
+        journal.record('https://example.com/1', 'detail', 'failed')
+        journal.close()
+
+        journal = CrawlJournal(self.file_name)
+        self.addCleanup(journal.close)
+        self.assertTrue(journal.is_interrupted())
+        journal.start(resume=True)
+        self.assertEqual(journal.get_done('https://example.com/list', 'list'), (['https://example.com/1'], 'hash'))
+        self.assertIsNone(journal.get_done('https://example.com/1', 'detail'))
+
+    def test_resume_after_finished_crawl_starts_over(self):
+        journal = CrawlJournal(self.file_name)
+        self.addCleanup(journal.close)
+        journal.start()
+        journal.record('https://example.com/list', 'list', 'done', 'hash', [])
+        journal.finish()
+
+        journal.start(resume=True)
+        self.assertIsNone(journal.get_done('https://example.com/list', 'list'))
+
+    def test_restart_forgets_urls(self):
+        journal = CrawlJournal(self.file_name)
+        self.addCleanup(journal.close)
+        journal.start()
+        journal.record('https://example.com/list', 'list', 'done', 'hash', [])
+        journal.start()
+        self.assertIsNone(journal.get_done('https://example.com/list', 'list'))
+
+
+class FakeResponse:
+    def __init__(self, status=200, headers=None, body=b'', charset='utf-8'):
+        self.status = status
+        self.headers = headers or {}
+        self.body = body
+        self.charset = charset
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise ValueError(self.status)
+
+    async def text(self):
+        return self.body.decode(self.charset)
+
+
+class FakeSession:
+    def __init__(self, response):
+        self.response = response
+        self.request_headers = None
+
+    def get(self, url, headers=None):
+        self.request_headers = headers
+        return self.response
+
+    head = get
+
+
+class HTTPCacheTest(SimpleTestCase):
+    url = 'https://example.com/painting'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.http_cache = HTTPCache(directory.name)
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def fetch_page(self, response):
+        session = FakeSession(response)
+        return self.loop.run_until_complete(fetch_page(session, self.http_cache, self.url)), session
+
+    def is_image_unchanged(self, response):
+        return self.loop.run_until_complete(is_image_unchanged(FakeSession(response), self.http_cache, self.url))
+
+    def test_not_modified_page_comes_from_cache(self):
+        self.http_cache.set(self.url, {'ETag': '"1"'}, 'utf-8', 'Утро'.encode())
+
+        (text, modified), session = self.fetch_page(FakeResponse(304))
+
+        self.assertEqual((text, modified), ('Утро', False))
+        self.assertEqual(session.request_headers, {'If-None-Match': '"1"'})
+        self.assertEqual(self.http_cache.not_modified_count, 1)
+
+    def test_changed_page_is_cached_again(self):
+        self.http_cache.set(self.url, {'ETag': '"1"'}, 'utf-8', 'Утро'.encode())
+
+        (text, modified), _ = self.fetch_page(FakeResponse(200, {'ETag': '"2"'}, 'Вечер'.encode()))
+
+        self.assertEqual((text, modified), ('Вечер', True))
+        self.assertEqual(self.http_cache.get(self.url)['etag'], '"2"')
+        self.assertEqual(self.http_cache.get_body(self.url), 'Вечер'.encode())
+        self.assertEqual(self.http_cache.modified_count, 1)
+
+    def test_image_is_compared_by_etag(self):
+        self.http_cache.set(self.url, {'ETag': '"1"', 'Content-Length': '10'})
+
+        self.assertTrue(self.is_image_unchanged(FakeResponse(200, {'ETag': '"1"', 'Content-Length': '20'})))
+        self.assertFalse(self.is_image_unchanged(FakeResponse(200, {'ETag': '"2"', 'Content-Length': '10'})))
+
+    def test_image_without_etag_is_compared_by_date_and_size(self):
+        last_modified = 'Sat, 01 Dec 2018 00:00:00 GMT'
+        self.http_cache.set(self.url, {'Last-Modified': last_modified, 'Content-Length': '10'})
+
+        self.assertTrue(self.is_image_unchanged(FakeResponse(200, {'Last-Modified': last_modified,
+                                                                   'Content-Length': '10'})))
+        self.assertFalse(self.is_image_unchanged(FakeResponse(200, {'Last-Modified': last_modified,
+                                                                    'Content-Length': '20'})))
+
+
+class PaintingBatchWriterTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = self.settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def make_metainfo(self, number, last_name):
+        return {
+            'site_url': f'https://example.com/{number}',
+            'title': f'Богатыри {number}',
+            'image_url': f'https://example.com/{number}.jpg',
+            'filename': f'Богатыри {number}.jpg',
+            'years': '1898',
+            'description': 'Холст, масло',
+            'author': {'first_name': 'Виктор', 'last_name': last_name, 'middle_name': None},
+        }
+
+    def test_batch_is_created_with_cached_authors(self):
+        metainfo_list = [self.make_metainfo(number, 'Васнецов' if number < 3 else 'Репин') for number in range(4)]
+        items = [(metainfo, store_image_files(metainfo, make_image_data())) for metainfo in metainfo_list]
+        writer = PaintingBatchWriter()
+        writer.write(items)
+        writer.notify_saved(items)
+
+        self.assertEqual(Author.objects.count(), 2)
+        self.assertEqual(Painting.objects.count(), 4)
+        painting = Painting.objects.get(site_url='https://example.com/0')
+        self.assertRegex(painting.image.name, r'^paintings/[0-9a-f]{32}\.jpg$')
+        self.assertEqual(self.client.get('/recognition/search', {'q': 'богатырь'}).json()['count'], 4)
+
+    def test_existing_painting_is_updated(self):
+        metainfo = self.make_metainfo(1, 'Васнецов')
+        writer = PaintingBatchWriter()
+        writer.write([(metainfo, store_image_files(metainfo, make_image_data()))])
+        image_name = Painting.objects.get().image.name
+
+        writer.write([(dict(metainfo, title='Три богатыря'), None)])
+
+        painting = Painting.objects.get()
+        self.assertEqual(painting.title, 'Три богатыря')
+        self.assertEqual(painting.image.name, image_name)
+
+    def test_replaced_image_files_are_deleted(self):
+        metainfo = self.make_metainfo(1, 'Васнецов')
+        writer = PaintingBatchWriter()
+        old_image_name, old_derivatives = files = store_image_files(metainfo, make_image_data())
+        writer.write([(metainfo, files)])
+
+        writer.write([(metainfo, store_image_files(metainfo, make_image_data(size=(800, 600))))])
+
+        storage = Painting._meta.get_field('image').storage
+        self.assertNotEqual(Painting.objects.get().image.name, old_image_name)
+        self.assertFalse(storage.exists(old_image_name))
+        self.assertFalse(storage.exists(json.loads(old_derivatives)['jpeg']['320']))
+
+    def test_files_of_rolled_back_batch_are_deleted(self):
+        metainfo = self.make_metainfo(1, 'Васнецов')
+        image_name, derivatives = files = store_image_files(metainfo, make_image_data())
+        storage = Painting._meta.get_field('image').storage
+
+        with mock.patch.object(Painting.objects, 'bulk_create', side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                PaintingBatchWriter().write([(metainfo, files)])
+
+        self.assertFalse(storage.exists(image_name))
+        self.assertFalse(storage.exists(json.loads(derivatives)['jpeg']['320']))
@@ -0,0 +1,47 @@
+import hashlib
+import io
+
+from django.conf import settings
+from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Uploaded file exceeds the size limit.'
+    default_code = 'upload_too_large'
+
+
+class HashingMemoryFileUploadHandler(FileUploadHandler):
+    """Buffers uploaded files in memory and hashes them while chunks arrive.
+
+    Unlike Django's default handlers it never spills to a temporary file;
+    files bigger than RECOGNITION_MAX_UPLOAD_SIZE are rejected with a 413 instead.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.buffer = io.BytesIO()
+        self.hasher = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.RECOGNITION_MAX_UPLOAD_SIZE:
+            raise UploadTooLarge(f'Uploaded file exceeds {settings.RECOGNITION_MAX_UPLOAD_SIZE} bytes.')
+        self.buffer.write(raw_data)
+        self.hasher.update(raw_data)
+
+    def file_complete(self, file_size):
+        self.buffer.seek(0)
+        uploaded_file = InMemoryUploadedFile(
+            file=self.buffer,
+            field_name=self.field_name,
+            name=self.file_name,
+            content_type=self.content_type,
+            size=file_size,
+            charset=self.charset,
+            content_type_extra=self.content_type_extra,
+        )
+        uploaded_file.sha256 = self.hasher.hexdigest()
+        return uploaded_file
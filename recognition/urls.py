@@ -1,13 +1,25 @@
 from django.conf.urls import include, url
 from rest_framework import routers
 
-from recognition.views import PaintingViewSet, ProgramAPIView, RecognizeAPIView
+from recognition.views import (
+    AuthorViewSet,
+    ExportView,
+    ModelStatusAPIView,
+    PaintingViewSet,
+    ProgramView,
+    RecognizeAPIView,
+    SearchAPIView,
+)
 
 router = routers.SimpleRouter()
 router.register(r'painting', PaintingViewSet)
+router.register(r'author', AuthorViewSet)
 
 urlpatterns = [
     url(r'', include(router.urls)),
-    url(r'^program$', ProgramAPIView.as_view()),
-    url(r'^recognize$', RecognizeAPIView.as_view())
+    url(r'^program$', ProgramView.as_view()),
+    url(r'^recognize$', RecognizeAPIView.as_view()),
+    url(r'^export$', ExportView.as_view()),
+    url(r'^search$', SearchAPIView.as_view()),
+    url(r'^model$', ModelStatusAPIView.as_view()),
 ]
@@ -1,66 +1,261 @@
-import tempfile
+import hashlib
+import mimetypes
+import os
+import posixpath
+from urllib.parse import quote
 
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.http import condition
 from rest_framework import generics, mixins, viewsets
+from rest_framework.decorators import detail_route
+from rest_framework.exceptions import NotFound
+from rest_framework.generics import get_object_or_404
+from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 
-from recognition.models import Painting
-from recognition.serializers import PaintingSerializer, RecognizeSerializer
-from scripts.label_image import main
+from recognition.cache import get_recognition_cache
+from recognition.catalog import catalog_condition
+from recognition.export import gzip_stream, iter_painting_lines
+from recognition.lookup import absolutize_payload, label_lookup_registry
+from recognition.models import Author, Painting
+from recognition.pagination import IdCursorPagination, LegacyPaginationMixin
+from recognition.payloads import painting_payload_cache
+from recognition.program import accepts_gzip, get_program_blob, get_program_etag
+from recognition.recognizer import get_recognizer
+from recognition.search import search_painting_ids
+from recognition.serializers import (
+    AuthorSerializer,
+    PaintingRowsSerializer,
+    PaintingSerializer,
+    RecognizeSerializer,
+    parse_expand,
+    parse_fields,
+    shape_payload,
+)
+from recognition.storage import is_hashed_name
+from recognition.uploadhandlers import HashingMemoryFileUploadHandler
 
 
-class PaintingViewSet(mixins.RetrieveModelMixin,
+class SparseFieldsMixin:
+    """Pass ``?fields=`` and ``?expand=`` of the request to painting serializers."""
+
+    def get_requested_fields(self):
+        return parse_fields(self.request.query_params)
+
+    def get_requested_expand(self):
+        return parse_expand(self.request.query_params)
+
+    def get_rows_serializer(self):
+        return PaintingRowsSerializer(
+            fields=self.get_requested_fields(),
+            expand=self.get_requested_expand(),
+            request=self.request,
+        )
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'] = self.get_requested_fields()
+        context['expand'] = self.get_requested_expand()
+        return context
+
+
+@method_decorator(catalog_condition, name='list')
+@method_decorator(catalog_condition, name='retrieve')
+class PaintingViewSet(LegacyPaginationMixin,
+                      SparseFieldsMixin,
+                      mixins.RetrieveModelMixin,
                       mixins.ListModelMixin,
                       viewsets.GenericViewSet):
-    queryset = Painting.objects.select_related('author').order_by('id')
+    queryset = Painting.objects.order_by('id')
     serializer_class = PaintingSerializer
 
+    def get_queryset(self):
+        return PaintingSerializer.setup_eager_loading(
+            super().get_queryset(),
+            fields=self.get_requested_fields(),
+            expand=self.get_requested_expand(),
+        )
 
-class ProgramAPIView(generics.GenericAPIView):
-    def get(self, request, format=None):
-        return Response(data={
-            "data": [
-                {
-                    "title": "Город и люди. Москва в графике ХХ века",
-                    "dates": "11 октября 2017 - 28 января 2018",
-                    "picture": "https://www.tretyakovgallery.ru/upload/iblock/951/95170e80eebc1f942139bf69536af350.jpg",
-                    "location": "Новая Третьяковка",
-                    "description": "А.А. Дейнека. Площадь Свердлова. 1941–1946. Серия «Москва военная». Бумага, гуашь, темпера, уголь. 67 х 81,7. Третьяковская галерея"
-                },
-                {
-                    'title': 'К 125-летию передачи Третьяковской галереи городу Москве',
-                    'dates': '29 сентября 2017 - 14 января 2018',
-                    'picture': 'https://www.tretyakovgallery.ru/upload/iblock/a1e/a1e3993e070a7258edc8762ba2c5181a.jpg',
-                    'location': 'Новая Третьяковка',
-                    'description': 'Васнецов В.М. После побоища Игоря Святославича с половцами. 1880',
-                },
-                {
-                    'title': '7-я Московская международная биеннале современного искусства',
-                    'dates': '19 сентября 2017  18 января 2018',
-                    'picture': 'https://www.tretyakovgallery.ru/upload/iblock/cc7/cc7ae75f3d25e7cfefdbc8ac2ddd43e3.jpg',
-                    'location': 'Новая Третьяковка',
-                    'description': 'Мэтью Барни. Космическая охота 1, 2017',
-                },
-                {
-                    'title': 'Шедевры русской графики из коллекции Государственного Исторического музея',
-                    'dates': '24 ноября 2017  29 апреля 2018',
-                    'picture': 'https://www.tretyakovgallery.ru/upload/iblock/4a1/4a1565562df7a458ff0720ea66442754.jpg',
-                    'location': 'Новая Третьяковка',
-                    'description': 'Флаговый штандарт советского павильона выставки «Пресса» в Кельне. Вид от Рейна',
-                }
-            ]
-        })
-
-
-class RecognizeAPIView(generics.GenericAPIView):
+    def list(self, request, *args, **kwargs):
+        rows_serializer = self.get_rows_serializer()
+        page = self.paginate_queryset(rows_serializer.setup_queryset(self.queryset.all()))
+        return self.get_paginated_response(rows_serializer.serialize(page))
+
+    def retrieve(self, request, *args, **kwargs):
+        painting_id = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        cache_key = painting_payload_cache.get_key(painting_id, request)
+        data = painting_payload_cache.get(cache_key)
+        if data is not None:
+            return Response(data)
+        response = super().retrieve(request, *args, **kwargs)
+        painting_payload_cache.set(cache_key, response.data)
+        return response
+
+
+@method_decorator(catalog_condition, name='retrieve')
+@method_decorator(catalog_condition, name='paintings')
+class AuthorViewSet(SparseFieldsMixin,
+                    mixins.RetrieveModelMixin,
+                    viewsets.GenericViewSet):
+    queryset = AuthorSerializer.setup_eager_loading(Author.objects.all())
+    serializer_class = AuthorSerializer
+    pagination_class = IdCursorPagination
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        # The author resource links to its paintings instead of embedding them
+        context['expand'] = ('author',)
+        return context
+
+    @detail_route()
+    def paintings(self, request, pk=None):
+        get_object_or_404(Author.objects.only('id'), pk=pk)
+        rows_serializer = self.get_rows_serializer()
+        queryset = rows_serializer.setup_queryset(Painting.objects.filter(author_id=pk).order_by('id'))
+        page = self.paginate_queryset(queryset)
+        return self.get_paginated_response(rows_serializer.serialize(page))
+
+
+class ProgramView(View):
+    """Serves the program as JSON pre-rendered and pre-compressed by recognition.program."""
+
+    @method_decorator(condition(etag_func=get_program_etag))
+    def get(self, request):
+        blob = get_program_blob(request)
+        if accepts_gzip(request):
+            response = HttpResponse(blob['gzip_content'], content_type='application/json')
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(blob['content'], content_type='application/json')
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+
+class ExportView(View):
+    """Streams the whole catalog as NDJSON, one painting per line, gzipped when accepted.
+
+    Takes the same ``?fields=`` and ``?expand=`` as the painting list.
+    """
+
+    def get(self, request):
+        content = iter_painting_lines(parse_fields(request.GET), parse_expand(request.GET), request)
+        if accepts_gzip(request):
+            response = StreamingHttpResponse(gzip_stream(content), content_type='application/x-ndjson')
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = StreamingHttpResponse(content, content_type='application/x-ndjson')
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+
+class MediaView(View):
+    """Serves MEDIA_ROOT, leaving the bytes to the web server unless MEDIA_SERVE_MODE is 'django'."""
+
+    def get(self, request, path):
+        path = posixpath.normpath(path).lstrip('/')
+        try:
+            full_path = safe_join(settings.MEDIA_ROOT, path)
+        except SuspiciousFileOperation:
+            raise Http404
+        if not os.path.isfile(full_path):
+            raise Http404
+
+        content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+        mode = settings.MEDIA_SERVE_MODE
+        if mode == 'x-accel-redirect':
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + quote(path)
+        elif mode == 'x-sendfile':
+            response = HttpResponse(content_type=content_type)
+            response['X-Sendfile'] = full_path
+        else:
+            response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+            response['Content-Length'] = os.path.getsize(full_path)
+
+        if is_hashed_name(path):
+            patch_cache_control(response, public=True, max_age=settings.MEDIA_IMMUTABLE_MAX_AGE, immutable=True)
+        else:
+            patch_cache_control(response, public=True, max_age=settings.MEDIA_MAX_AGE)
+        return response
+
+
+class RecognizeAPIView(SparseFieldsMixin, generics.GenericAPIView):
     serializer_class = RecognizeSerializer
 
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers = [HashingMemoryFileUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
     def post(self, request, format=None):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        tempfile_ = tempfile.NamedTemporaryFile()
         with serializer.validated_data['file'] as f:
-            tempfile_.write(f.read())
-        painting_id = main(tempfile_.name)
+            image_data = f.read()
+            content_hash = getattr(f, 'sha256', None) or hashlib.sha256(image_data).hexdigest()
 
-        painting = Painting.objects.get(id=painting_id)
-        return Response(PaintingSerializer(painting, context=self.get_serializer_context()).data)
+        recognizer = get_recognizer()
+        cache = get_recognition_cache()
+        cache_key = f'{content_hash}-{recognizer.model_version}'
+        cached = cache.get(cache_key)
+        if cached is not None:
+            painting_id = cached['painting_id']
+        else:
+            label = recognizer.recognize(image_data)
+            if label is None:
+                # Embedding mode with no painting embedded yet
+                raise NotFound('No painting to recognize against.')
+            painting_id = label_lookup_registry.get(recognizer).get_painting_id(label)
+            if painting_id is None:
+                # Paintings embedded since the lookup was built
+                painting_id = get_object_or_404(Painting.objects.only('id'), id=label).id
+            cache.set(cache_key, {'painting_id': painting_id})
+        return Response(self.get_painting_data(recognizer, painting_id))
+
+    def get_painting_data(self, recognizer, painting_id):
+        cache_key = painting_payload_cache.get_key(painting_id, self.request)
+        data = painting_payload_cache.get(cache_key)
+        if data is not None:
+            return data
+        fields = self.get_requested_fields()
+        expand = self.get_requested_expand()
+        payload = None
+        lookup = label_lookup_registry.get(recognizer)
+        # Payloads of a lookup being rebuilt may be outdated, and none embeds the author's paintings
+        if not label_lookup_registry.stale and 'author.paintings' not in expand:
+            payload = lookup.payloads.get(str(painting_id))
+        if payload is not None:
+            data = absolutize_payload(shape_payload(payload, fields, expand), self.request)
+        else:
+            queryset = PaintingSerializer.setup_eager_loading(Painting.objects, fields, expand)
+            painting = get_object_or_404(queryset, id=painting_id)
+            data = PaintingSerializer(painting, context=self.get_serializer_context()).data
+        painting_payload_cache.set(cache_key, data)
+        return data
+
+
+class SearchAPIView(SparseFieldsMixin, generics.GenericAPIView):
+    """Paintings matching ``?q=`` by title, description and author name, best ranked first."""
+    serializer_class = PaintingSerializer
+    pagination_class = PageNumberPagination
+
+    def get(self, request, format=None):
+        query = request.query_params.get('q', '').strip()
+        painting_ids = search_painting_ids(query, settings.SEARCH_MAX_RESULTS) if query else []
+        page_ids = self.paginate_queryset(painting_ids)
+        rows_serializer = self.get_rows_serializer()
+        rows = {row['id']: row for row in rows_serializer.setup_queryset(Painting.objects.filter(id__in=page_ids))}
+        page = [rows[painting_id] for painting_id in page_ids if painting_id in rows]
+        return self.get_paginated_response(rows_serializer.serialize(page))
+
+
+class ModelStatusAPIView(generics.GenericAPIView):
+    def get(self, request, format=None):
+        data = get_recognizer().status()
+        data['cache'] = get_recognition_cache().status()
+        return Response(data=data)
@@ -56,8 +56,8 @@ def read_tensor_from_image_file(file_name, input_height=299, input_width=299,
     dims_expander = tf.expand_dims(float_caster, 0);
     resized = tf.image.resize_bilinear(dims_expander, [input_height, input_width])
     normalized = tf.divide(tf.subtract(resized, [input_mean]), [input_std])
-    sess = tf.Session()
-    result = sess.run(normalized)
+    with tf.Session() as sess:
+        result = sess.run(normalized)
 
     return result
 
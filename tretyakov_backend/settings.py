@@ -85,6 +85,22 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/1.11/topics/cache/
+# LocMemCache is per process: the generations invalidating recognition
+# results and painting payloads only move in the process that saved. Use a
+# shared backend (e.g. memcached) in production so they reach every worker
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
 
@@ -147,3 +163,54 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 50,
 }
+
+RECOGNITION_MODEL_FILE = os.path.join(BASE_DIR, 'tf_files', 'retrained_graph.pb')
+RECOGNITION_LABELS_FILE = os.path.join(BASE_DIR, 'tf_files', 'retrained_labels.txt')
+RECOGNITION_INPUT_LAYER = 'input'
+RECOGNITION_OUTPUT_LAYER = 'final_result'
+RECOGNITION_INPUT_HEIGHT = 224
+RECOGNITION_INPUT_WIDTH = 224
+RECOGNITION_INPUT_MEAN = 128
+RECOGNITION_INPUT_STD = 128
+# Load the model when the WSGI application starts, so no request pays for it
+RECOGNITION_PRELOAD_MODEL = True
+RECOGNITION_MAX_UPLOAD_SIZE = 20 * 1024 * 1024
+# Concurrent recognitions are grouped into one sess.run of up to
+# RECOGNITION_BATCH_MAX_SIZE images, waiting at most RECOGNITION_BATCH_MAX_WAIT seconds
+RECOGNITION_BATCH_MAX_SIZE = 16
+RECOGNITION_BATCH_MAX_WAIT = 0.005
+# 'classifier' answers with the retrained final layer, 'embedding' with the
+# nearest painting by cosine similarity of bottleneck vectors
+RECOGNITION_MODE = 'classifier'
+RECOGNITION_BOTTLENECK_LAYER = 'input_1/BottleneckInputPlaceholder'
+RECOGNITION_EMBEDDING_DIMENSION = 1001
+RECOGNITION_EMBEDDING_REFRESH_INTERVAL = 10
+# Built offline by the build_ann_index command, exact search is used without it
+RECOGNITION_ANN_INDEX_PATH = os.path.join(BASE_DIR, 'tf_files', 'ann_index')
+RECOGNITION_ANN_NPROBE = 8
+RECOGNITION_ANN_REFINE_FACTOR = 4
+# Recognition results by upload hash, RECOGNITION_CACHE_DIR enables the file tier
+RECOGNITION_CACHE_MAX_ENTRIES = 1024
+RECOGNITION_CACHE_DIR = None
+# Label to painting mapping with pre-rendered payloads, stored next to the model
+RECOGNITION_LOOKUP_FILE = os.path.join(BASE_DIR, 'tf_files', 'retrained_lookup.json')
+RECOGNITION_LOOKUP_CHECK_INTERVAL = 60
+PAINTING_PAYLOAD_CACHE_TIMEOUT = 24 * 60 * 60
+# Ranked search results beyond this are not paginated
+SEARCH_MAX_RESULTS = 1000
+# Scaled down copies of painting images exposed as srcset, see recognition.derivatives
+PAINTING_DERIVATIVE_WIDTHS = (320, 640, 1280)
+PAINTING_DERIVATIVE_FORMATS = ('jpeg', 'webp')
+PAINTING_DERIVATIVE_QUALITY = 85
+# How MediaView hands files over: 'django' streams them itself, 'x-accel-redirect' (nginx)
+# and 'x-sendfile' (Apache, lighttpd) only send a header and let the web server send the bytes
+MEDIA_SERVE_MODE = 'django'
+# nginx internal location aliased to MEDIA_ROOT, used by the 'x-accel-redirect' mode
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+# Content-hashed names never change content, other names may be overwritten
+MEDIA_IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+MEDIA_MAX_AGE = 60 * 60
+# Checkpoints of parse_tretyakov, an interrupted crawl resumes from them
+PARSER_JOURNAL_FILE = os.path.join(BASE_DIR, 'parser_journal.sqlite3')
+# Pages and image validators of the last crawl, for conditional re-crawls
+PARSER_HTTP_CACHE_DIR = os.path.join(BASE_DIR, 'parser_http_cache')
@@ -13,10 +13,16 @@ Including another URLconf
     1. Import the include() function: from django.conf.urls import url, include
     2. Add a URL to urlpatterns:  url(r'^blog/', include('blog.urls'))
 """
+import re
+
+from django.conf import settings
 from django.conf.urls import url, include
 from django.contrib import admin
 
+from recognition.views import MediaView
+
 urlpatterns = [
     url(r'^admin/', admin.site.urls),
     url(r'^recognition/', include('recognition.urls')),
+    url(r'^%s(?P<path>.+)$' % re.escape(settings.MEDIA_URL.lstrip('/')), MediaView.as_view()),
 ]
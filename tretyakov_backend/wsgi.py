@@ -7,6 +7,7 @@ For more information on this file, see
 https://docs.djangoproject.com/en/1.11/howto/deployment/wsgi/
 """
 
+import logging
 import os
 
 from django.core.wsgi import get_wsgi_application
@@ -14,3 +15,16 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tretyakov_backend.settings")
 
 application = get_wsgi_application()
+
+from django.conf import settings  # noqa: E402
+
+# Only the model is loaded here: the label lookup needs the database and is built on the first recognition
+if settings.RECOGNITION_PRELOAD_MODEL:
+    if os.path.exists(settings.RECOGNITION_MODEL_FILE) and os.path.exists(settings.RECOGNITION_LABELS_FILE):
+        from recognition.recognizer import get_recognizer  # noqa: E402
+
+        get_recognizer().load()
+    else:
+        logging.getLogger('tretyakov.recognition').warning(
+            'Model %s not found, recognition is unavailable until it is trained', settings.RECOGNITION_MODEL_FILE,
+        )